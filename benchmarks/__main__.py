@@ -0,0 +1,52 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmarks.suite import SCENARIOS, run_scenario
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="SQLite backend benchmarks, JSON results on stdout")
+    parser.add_argument("--sizes", default="1000,100000", help="comma separated table sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--storage", default="memory,file", help="comma separated: memory, file")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenario names")
+    parser.add_argument("--ops", type=int, default=2000, help="timed single-row operations per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {"meta": {"commit": git_commit(), "python": sys.version.split()[0], "sqlite": sqlite3.sqlite_version,
+                       "platform": platform.platform(), "started": time.time(), "ops": args.ops, "seed": args.seed},
+              "runs": []}
+    ctx = multiprocessing.get_context("spawn")
+    for size in map(int, args.sizes.split(",")):
+        for storage in args.storage.split(","):
+            for name in args.scenarios.split(","):
+                with ctx.Pool(1) as pool:
+                    run = pool.apply(run_scenario, (name, storage, size, args.ops, args.seed))
+                report["runs"].append(dict(scenario=name, storage=storage, rows=size, **run))
+                print(f"{name:20} {storage:6} {size:>9,} rows  done", file=sys.stderr)
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == '__main__':
+    main()
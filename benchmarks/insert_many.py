@@ -0,0 +1,53 @@
+import time
+
+import simpleSQL
+
+
+class BenchRow:
+    def __init__(self, id, name, tags):
+        self.id = id
+        self.name = name
+        self.tags = tags
+
+
+def create_table(db):
+    data = BenchRow(
+        db.types.column(db.types.integer(), auto_increment=True),
+        db.types.column(db.types.varchar(50)),
+        db.types.column(db.types.objType())
+    )
+    db.create_table(BenchRow, data, primary_key="id")
+
+
+def rows(db, n):
+    return (BenchRow(db.AUTO_INC, f"row{i}", [i, i + 1]) for i in range(n))
+
+
+def bench_insert_to(n):
+    with simpleSQL.connect(serverless=True, database=":memory:") as db:
+        create_table(db)
+        start = time.perf_counter()
+        for row in rows(db, n):
+            db.insert_to(BenchRow, row)
+        db.commit()
+        return n / (time.perf_counter() - start)
+
+
+def bench_insert_many(n, batch_size=1000):
+    with simpleSQL.connect(serverless=True, database=":memory:") as db:
+        create_table(db)
+        start = time.perf_counter()
+        db.insert_many(BenchRow, rows(db, n), batch_size=batch_size)
+        db.commit()
+        return n / (time.perf_counter() - start)
+
+
+def main(n=100_000):
+    looped = bench_insert_to(n)
+    batched = bench_insert_many(n)
+    print(f"insert_to:   {looped:12,.0f} rows/sec")
+    print(f"insert_many: {batched:12,.0f} rows/sec ({batched / looped:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
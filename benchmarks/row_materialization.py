@@ -0,0 +1,78 @@
+import json
+import sys
+import time
+import tracemalloc
+
+import simpleSQL
+
+
+class BenchRow:
+    def __init__(self, id, name, price, tags):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.tags = tags
+
+
+class LegacyDBTable:
+    # the pre-row-factory path: one __dict__ object per row plus a setattr per cell
+
+    def __getattribute__(self, item):
+        return super(LegacyDBTable, self).__getattribute__(item)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+
+def legacy_query_all(executor, table):
+    executor.execute(f"SELECT * FROM {table.__name__}")
+    names = [d[0] for d in executor._cursor.description]
+    res = []
+    for cols in executor._cursor.fetchall():
+        t = LegacyDBTable()
+        for i, col in enumerate(names):
+            if type(cols[i]) == str:
+                if '{"list": ' in cols[i]:
+                    t[col] = json.loads(cols[i])['list']
+                elif '{"dict": ' in cols[i]:
+                    t[col] = json.loads(cols[i])['dict']
+                else:
+                    t[col] = cols[i]
+            else:
+                t[col] = cols[i]
+        res.append(t)
+    return [table(**item.__dict__) for item in res]
+
+
+def measure(fn):
+    # timed without tracemalloc, whose per-allocation hook would dominate the timing
+    start = time.perf_counter()
+    rows = len(fn())
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main(n=1_000_000):
+    with simpleSQL.connect(serverless=True, database=":memory:") as db:
+        data = BenchRow(
+            db.types.column(db.types.integer(), auto_increment=True),
+            db.types.column(db.types.varchar(50)),
+            db.types.column(db.types.integer()),
+            db.types.column(db.types.varchar(50))
+        )
+        db.create_table(BenchRow, data, primary_key="id")
+        db.insert_many(BenchRow, (BenchRow(db.AUTO_INC, f"row{i}", i, f"tag{i % 10}") for i in range(n)))
+        db.commit()
+
+        for label, fn in (("legacy DBTable", lambda: legacy_query_all(db.executor, BenchRow)),
+                          ("row factory", lambda: db.query_all(BenchRow))):
+            rows, elapsed, peak = measure(fn)
+            print(f"{label:15} {rows:,} rows  {elapsed:7.2f}s  peak {peak / 2 ** 20:8.1f} MiB")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,58 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+import simpleSQL
+from simpleSQL import F
+
+
+class BenchRow:
+    def __init__(self, id, name, price):
+        self.id = id
+        self.name = name
+        self.price = price
+
+
+def run(path, shards, n, scans, lookups):
+    res = {}
+    with simpleSQL.connect(serverless=True, database=path, profile="fast", shards=shards, shard_key="id") as db:
+        t = db.types
+        db.create_table(BenchRow, BenchRow(t.column(t.integer()), t.column(t.varchar(50)), t.column(t.integer())),
+                        primary_key="id")
+        start = time.perf_counter()
+        db.insert_many(BenchRow, (BenchRow(i, f"row{i}", i % 1000) for i in range(n)), batch_size=10_000)
+        db.commit()
+        res["insert"] = n / (time.perf_counter() - start)
+
+        # full scans that return few rows: the time is spent inside SQLite, which runs without the GIL
+        start = time.perf_counter()
+        for i in range(scans):
+            db.query_filters(BenchRow, (F("price") == i % 1000) & F("name").like("row1%"))
+        res["scan"] = scans / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(scans):
+            db.query_ordered(BenchRow, "id", reverse=True, limit=100)
+        res["ordered"] = scans / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(lookups):
+            db.query_filter_by(BenchRow, "id", random.randrange(n), first=True)
+        res["lookup"] = lookups / (time.perf_counter() - start)
+    return res
+
+
+def main(n=500_000, scans=50, lookups=5000):
+    random.seed(0)
+    print(f"{'shards':>6} {'insert rows/s':>14} {'scans/s':>10} {'ordered/s':>10} {'lookups/s':>10}")
+    for shards in (1, 2, 4, 8):
+        with tempfile.TemporaryDirectory() as tmp:
+            res = run(os.path.join(tmp, "bench.db"), shards, n, scans, lookups)
+        print(f"{shards:>6} {res['insert']:>14,.0f} {res['scan']:>10,.1f} {res['ordered']:>10,.1f} "
+              f"{res['lookup']:>10,.0f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
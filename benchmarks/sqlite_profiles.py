@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import time
+
+import simpleSQL
+
+
+class BenchRow:
+    def __init__(self, id, name, tags):
+        self.id = id
+        self.name = name
+        self.tags = tags
+
+
+def write_throughput(path, profile, n, commit_every):
+    with simpleSQL.connect(serverless=True, database=path, profile=profile) as db:
+        data = BenchRow(
+            db.types.column(db.types.integer(), auto_increment=True),
+            db.types.column(db.types.varchar(50)),
+            db.types.column(db.types.objType())
+        )
+        db.create_table(BenchRow, data, primary_key="id")
+        db.commit()
+        start = time.perf_counter()
+        for i in range(n):
+            db.insert_to(BenchRow, BenchRow(db.AUTO_INC, f"row{i}", [i]))
+            if i % commit_every == 0:
+                db.commit()
+        db.commit()
+        return n / (time.perf_counter() - start)
+
+
+def main(n=20_000, commit_every=10):
+    for profile in (None, "safe", "fast"):
+        with tempfile.TemporaryDirectory() as tmp:
+            rate = write_throughput(os.path.join(tmp, "bench.db"), profile, n, commit_every)
+        print(f"{str(profile):6} {rate:12,.0f} rows/sec (commit every {commit_every} rows)")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,178 @@
+import os
+import random
+import resource
+import statistics
+import tempfile
+import threading
+import time
+
+import simpleSQL
+
+
+class BenchRow:
+    def __init__(self, id, name, price):
+        self.id = id
+        self.name = name
+        self.price = price
+
+
+class WideRow:
+    def __init__(self, id, name, title, description, price, amount, tags, scores, details, meta):
+        self.id = id
+        self.name = name
+        self.title = title
+        self.description = description
+        self.price = price
+        self.amount = amount
+        self.tags = tags
+        self.scores = scores
+        self.details = details
+        self.meta = meta
+
+
+def make_row(db, i):
+    return BenchRow(db.AUTO_INC, f"row{i}", i % 1000)
+
+
+def make_wide_row(db, i):
+    return WideRow(db.AUTO_INC, f"row{i}", f"title {i}", "x" * 100, i % 1000, i % 7,
+                   [f"tag{i % 10}", f"tag{i % 3}"], [i, i * 2, i * 3],
+                   {"price": i % 1000, "amount": i % 7, "note": "n" * 20}, {"source": "bench", "n": i})
+
+
+def create_tables(db):
+    t = db.types
+    db.create_table(BenchRow, BenchRow(t.column(t.integer(), auto_increment=True), t.column(t.varchar(50)),
+                                       t.column(t.integer())), primary_key="id")
+    db.create_table(WideRow, WideRow(t.column(t.integer(), auto_increment=True), t.column(t.varchar(50)),
+                                     t.column(t.varchar(100)), t.column(t.text(200)), t.column(t.integer()),
+                                     t.column(t.integer()), t.column(t.objType()), t.column(t.objType()),
+                                     t.column(t.objType()), t.column(t.objType())), primary_key="id")
+
+
+def _latencies(fn, args_list) -> list:
+    res = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        res.append(time.perf_counter() - started)
+    return res
+
+
+def _summary(operations: int, elapsed: float, latencies: list = None) -> dict:
+    res = {"operations": operations, "seconds": elapsed,
+           "throughput": operations / elapsed if elapsed else None}
+    if latencies:
+        ordered = sorted(latencies)
+        res["p50_ms"] = statistics.median(ordered) * 1000
+        res["p99_ms"] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    return res
+
+
+def _populate(db, table, make, rows):
+    started = time.perf_counter()
+    db.insert_many(table, (make(db, i) for i in range(rows)), batch_size=5000)
+    db.commit()
+    return time.perf_counter() - started
+
+
+def scenario_insert(db, rows, ops):
+    elapsed = _populate(db, BenchRow, make_row, rows)
+    res = {"insert_many": _summary(rows, elapsed)}
+    latencies = _latencies(db.insert_to, [(BenchRow, make_row(db, i)) for i in range(ops)])
+    db.commit()
+    res["insert_to"] = _summary(ops, sum(latencies), latencies)
+    return res
+
+
+def scenario_select(db, rows, ops):
+    _populate(db, BenchRow, make_row, rows)
+    repeats = max(3, min(20, 1_000_000 // max(rows, 1)))
+    latencies = _latencies(db.query_all, [(BenchRow,)] * repeats)
+    res = {"query_all": dict(_summary(repeats * rows, sum(latencies), latencies), unit="rows")}
+    keys = [(BenchRow, "id", random.randint(1, rows)) for _ in range(ops)]
+    latencies = _latencies(db.query_filter_by, keys)
+    res["query_filter_by_pk"] = _summary(ops, sum(latencies), latencies)
+    scans = [(BenchRow, "price", random.randint(0, 999)) for _ in range(min(ops, 50))]
+    latencies = _latencies(db.query_filter_by, scans)
+    res["query_filter_by_scan"] = _summary(len(scans), sum(latencies), latencies)
+    return res
+
+
+def scenario_update(db, rows, ops):
+    _populate(db, BenchRow, make_row, rows)
+    updates = [(BenchRow, BenchRow(random.randint(1, rows), f"updated{i}", i)) for i in range(ops)]
+    latencies = _latencies(db.query_update_table, updates)
+    db.commit()
+    return {"query_update_table": _summary(ops, sum(latencies), latencies)}
+
+
+def scenario_delete(db, rows, ops):
+    _populate(db, BenchRow, make_row, rows)
+    ids = random.sample(range(1, rows + 1), min(ops, rows))
+    latencies = _latencies(db.query_delete_by, [(BenchRow, ("id", i)) for i in ids])
+    db.commit()
+    return {"query_delete_by": _summary(len(ids), sum(latencies), latencies)}
+
+
+def scenario_wide(db, rows, ops):
+    elapsed = _populate(db, WideRow, make_wide_row, rows)
+    res = {"insert_many": _summary(rows, elapsed)}
+    repeats = max(3, min(10, 200_000 // max(rows, 1)))
+    latencies = _latencies(db.query_all, [(WideRow,)] * repeats)
+    res["query_all"] = dict(_summary(repeats * rows, sum(latencies), latencies), unit="rows")
+    instrumentation = db.enable_instrumentation(slow_ms=None)
+    db.query_all(WideRow)
+    query_all = instrumentation.stats()["operations"]["query_all"]
+    res["packing"] = {"driver_ms": query_all["driver_ms"], "materialize_ms": query_all["materialize_ms"]}
+    return res
+
+
+def scenario_concurrent_readers(path, rows, ops, threads=4):
+    with simpleSQL.connect(serverless=True, database=path, profile="fast") as db:
+        create_tables(db)
+        _populate(db, BenchRow, make_row, rows)
+    latencies = []
+    lock = threading.Lock()
+
+    def reader():
+        with simpleSQL.connect(serverless=True, database=path, profile="fast") as db:
+            own = _latencies(db.query_filter_by, [(BenchRow, "id", random.randint(1, rows)) for _ in range(ops)])
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=reader) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return {f"query_filter_by_{threads}_threads": _summary(len(latencies), elapsed, latencies)}
+
+
+SCENARIOS = {
+    "insert": scenario_insert,
+    "select": scenario_select,
+    "update": scenario_update,
+    "delete": scenario_delete,
+    "wide": scenario_wide,
+    "concurrent_readers": scenario_concurrent_readers,
+}
+
+
+def run_scenario(name: str, storage: str, rows: int, ops: int, seed: int = 0) -> dict:
+    # runs in a fresh process, so ru_maxrss is the peak of this scenario alone
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db") if storage == "file" else ":memory:"
+        if name == "concurrent_readers":
+            if storage != "file":
+                return {"results": {"skipped": "concurrent readers need a file database"}}
+            results = scenario_concurrent_readers(path, rows, ops)
+        else:
+            with simpleSQL.connect(serverless=True, database=path) as db:
+                create_tables(db)
+                results = SCENARIOS[name](db, rows, ops)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"results": results, "peak_rss_mb": peak / 1024}
@@ -1 +1,3 @@
 from .executor import connect
+from .aio import connect_async
+from .expressions import F, Count, Sum, Avg, Min, Max
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+
+class IndexAdvisor:
+    def __init__(self, executor, slow_ms: float = 5.0, min_calls: int = 5, auto_create: bool = False):
+        self._executor = executor
+        self.slow_ms = slow_ms
+        self.min_calls = min_calls
+        self.auto_create = auto_create
+        self._usage = {}
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def record(self, table: str, column: str, elapsed: float, sample: Any = None):
+        with self._lock:
+            usage = self._usage.get((table, column))
+            if usage is None:
+                usage = self._usage[(table, column)] = {"calls": 0, "total": 0.0, "max": 0.0, "sample": None}
+            usage["calls"] += 1
+            usage["total"] += elapsed
+            usage["max"] = max(usage["max"], elapsed)
+            if sample is not None:
+                usage["sample"] = sample
+        if self.auto_create and (table, column) not in self._created and self._is_hot(usage):
+            suggestion = self._advise(table, column, usage)
+            self._created.add((table, column))
+            if suggestion:
+                self._executor.execute_create_index(table, (column,), suggestion["index"])
+
+    def _is_hot(self, usage: dict) -> bool:
+        return usage["calls"] >= self.min_calls and usage["total"] / usage["calls"] * 1000 >= self.slow_ms
+
+    def _advise(self, table: str, column: str, usage: dict) -> [dict, None]:
+        expression = self._executor.column_sql(table, column)
+        if usage["sample"] is None:
+            plan = self._executor.explain(f"SELECT * FROM {table} ORDER BY {expression}")
+        else:
+            plan = self._executor.explain(f"SELECT * FROM {table} WHERE {expression} = {self._executor.placeholder}",
+                                          (usage["sample"],))
+        if not self._executor.plan_scans(plan):
+            return None
+        return {"table": table, "column": column, "index": f"idx_{table}_{column.replace('.', '_')}",
+                "calls": usage["calls"], "avg_ms": usage["total"] / usage["calls"] * 1000,
+                "max_ms": usage["max"] * 1000, "plan": plan}
+
+    def stats(self) -> list:
+        with self._lock:
+            return [{"table": table, "column": column, "calls": usage["calls"],
+                     "avg_ms": usage["total"] / usage["calls"] * 1000, "max_ms": usage["max"] * 1000}
+                    for (table, column), usage in self._usage.items()]
+
+    def report(self) -> list:
+        with self._lock:
+            hot = [(key, dict(usage)) for key, usage in self._usage.items() if self._is_hot(usage)]
+        suggestions = [self._advise(table, column, usage) for (table, column), usage in hot]
+        return [s for s in suggestions if s]
+
+    def apply(self) -> list:
+        suggestions = self.report()
+        for suggestion in suggestions:
+            self._executor.execute_create_index(suggestion["table"], (suggestion["column"],), suggestion["index"])
+            self._created.add((suggestion["table"], suggestion["column"]))
+        return [suggestion["index"] for suggestion in suggestions]
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterable
+
+from .executor import SimpleSQL, connect
+from .expressions import Expr
+
+
+class AsyncSimpleSQL:
+    AUTO_INC = SimpleSQL.AUTO_INC
+    _thread_bound = ("open_blob",)
+
+    def __init__(self, *args, **kwargs):
+        self._connect_args = args
+        self._connect_kwargs = kwargs
+        # every driver call runs on this one thread, which also owns the connection
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="simpleSQL")
+        self._sync: SimpleSQL = None
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, functools.partial(fn, *args, **kwargs))
+
+    async def __aenter__(self):
+        executor = await self._run(connect, *self._connect_args, **self._connect_kwargs)
+        self._sync = executor.__enter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await self._run(self._sync.executor.__exit__, exc_type, exc_val, exc_tb)
+        finally:
+            self._thread.shutdown(wait=False)
+
+    def __getattr__(self, item):
+        if item in self._thread_bound:
+            raise AttributeError(f"{item}() returns an object bound to the connection thread, "
+                                 f"it can't be used from the event loop")
+        attr = getattr(self._sync, item)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+
+        return method
+
+    async def query_iter(self, table: type, filters: [str, Expr] = None, chunk_size: int = 1000,
+                         columns: Iterable[str] = None, defer: Iterable[str] = None) -> AsyncIterator:
+        rows = await self._run(self._sync.query_iter, table, filters, chunk_size, columns, defer)
+        try:
+            while True:
+                chunk = await self._run(list, itertools.islice(rows, chunk_size))
+                if not chunk:
+                    return
+                for row in chunk:
+                    yield row
+        finally:
+            # the cursor belongs to the worker thread, also when the caller stops iterating early
+            await self._run(rows.close)
+
+    def session(self) -> AsyncSession:
+        return AsyncSession(self, self._sync.session())
+
+
+class AsyncSession:
+    # add/update/delete only queue changes in memory, everything touching the connection runs on its thread
+    def __init__(self, db: AsyncSimpleSQL, session):
+        self._db = db
+        self._session = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._db._run(self._session.__exit__, exc_type, exc_val, exc_tb)
+
+    def add(self, instance):
+        self._session.add(instance)
+
+    def update(self, instance, prime_indexes=0):
+        self._session.update(instance, prime_indexes)
+
+    def delete(self, instance):
+        self._session.delete(instance)
+
+    async def flush(self):
+        await self._db._run(self._session.flush)
+
+    async def rollback(self):
+        await self._db._run(self._session.rollback)
+
+
+def connect_async(*args, **kwargs) -> AsyncSimpleSQL:
+    return AsyncSimpleSQL(*args, **kwargs)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import os
+
+
+class ChunkedBlob:
+    # file-like access to one binary cell for drivers without incremental blob I/O,
+    # every read/write moves one chunk with a substring/splice statement; like sqlite3.Blob the size is fixed
+    def __init__(self, executor, table: str, column: str, key_column: str, key, readonly: bool = True):
+        self._executor = executor
+        self._column = column
+        self._readonly = readonly
+        ph = executor.placeholder
+        self._where = (f"FROM {table} WHERE {key_column} = {ph}", f"WHERE {key_column} = {ph}")
+        self._table = table
+        self._key = key
+        self._pos = 0
+        self._length = self._query(f"SELECT LENGTH({column}) {self._where[0]}", (key,))
+        if self._length is None:
+            raise ValueError(f"no blob in {table}.{column} for {key_column} = {key!r}")
+
+    def _query(self, statement: str, params: tuple):
+        self._executor.execute(statement, params)
+        row = self._executor._cursor.fetchone()
+        return row[0] if row else None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, origin: int = os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: self._length}[origin]
+        if not 0 <= base + offset <= self._length:
+            raise ValueError("offset out of blob range")
+        self._pos = base + offset
+
+    def read(self, length: int = -1) -> bytes:
+        if length < 0 or self._pos + length > self._length:
+            length = self._length - self._pos
+        if length <= 0:
+            return b""
+        data = self._query(f"SELECT {self._executor._substring}({self._column}, {self._executor.placeholder}, "
+                           f"{self._executor.placeholder}) {self._where[0]}", (self._pos + 1, length, self._key))
+        self._pos += len(data)
+        return bytes(data)
+
+    def write(self, data):
+        if self._readonly:
+            raise ValueError("blob opened read only")
+        data = bytes(data)
+        if self._pos + len(data) > self._length:
+            raise ValueError("data longer than blob length")
+        splice, params = self._executor._splice(self._column, self._pos, data)
+        self._executor.execute(f"UPDATE {self._table} SET {self._column} = {splice} {self._where[1]}",
+                               params + (self._key,))
+        self._pos += len(data)
+
+    def close(self):
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import itertools
+
+
+class DeferredLoader:
+    def __init__(self, executor, table: str, primary_key: str, columns: tuple, batch_size: int = 500,
+                 window: int = None):
+        self._executor = executor
+        self._table = table
+        self._primary_key = primary_key
+        self.columns = columns
+        self._batch_size = batch_size
+        # streamed results only keep the instances of the latest window (one fetchmany chunk)
+        self._window = window
+        self._pending = []
+
+    def track(self, instance):
+        if self._window and len(self._pending) >= self._window:
+            self._pending = []
+        self._pending.append(instance)
+
+    def load(self, instances: list = None):
+        # fills the deferred columns of every instance of the result set that hasn't been loaded yet,
+        # or of the given instances
+        if instances is None:
+            pending, self._pending = self._pending, []
+        else:
+            pending = instances
+        by_key = {instance.__dict__[self._primary_key]: instance for instance in pending}
+        keys = iter(by_key)
+        while True:
+            batch = tuple(itertools.islice(keys, self._batch_size))
+            if not batch:
+                break
+            rows = self._executor.execute_select(
+                self._table, columns=(self._primary_key,) + self.columns,
+                condition=f"{self._primary_key} IN ({','.join([self._executor.placeholder] * len(batch))})",
+                params=batch)
+            for row in rows:
+                by_key[row[0]].__dict__.update(zip(self.columns, row[1:]))
+        tracker = self._executor.tracker
+        for instance in pending:
+            for column in self.columns:
+                instance.__dict__.setdefault(column, None)
+            if tracker is not None:
+                tracker.track(instance, self.columns)
+
+
+def deferred_type(table: type, loader: DeferredLoader) -> type:
+    # same name as the model so statements built from type(instance).__name__ still target its table
+    def __getattr__(self, item):
+        if item in loader.columns:
+            loader.load()
+            if item not in self.__dict__:
+                # dropped with an earlier window of a streamed result
+                loader.load([self])
+            return self.__dict__[item]
+        raise AttributeError(f"'{table.__name__}' object has no attribute '{item}'")
+
+    return type(table.__name__, (table,), {"__getattr__": __getattr__, "__module__": table.__module__})
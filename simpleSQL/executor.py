@@ -1,12 +1,31 @@
 from __future__ import annotations
 
 import asyncio
+import copy
 import json
 import os
+from collections import OrderedDict
 from ctypes import Union
-from typing import Any, Sequence, Iterable
+from typing import Any, Sequence, Iterable, Callable
 
 import enum
+import threading
+import time
+import functools
+import itertools
+from collections import namedtuple
+
+from .advisor import IndexAdvisor
+from .blob import ChunkedBlob
+from .cache import ResultCache
+from .deferred import DeferredLoader, deferred_type
+from .expressions import Aggregate, Expr
+from .instrumentation import Instrumentation
+from .pool import ConnectionPool
+from .session import Session
+from .shard import ShardedExecutor
+from .tracking import ChangeTracker
+from . import transfer
 
 
 class DatabaseNotExist(Exception):
@@ -19,22 +38,25 @@ class DatabaseExist(Exception):
         super().__init__("Cant create database that already exists. " + msg)
 
 
-class DBTable:
+@functools.lru_cache(maxsize=256)
+def _row_type(names: tuple) -> type:
+    return namedtuple("DBRow", names, rename=True)
 
-    def __getattribute__(self, item):
-        return super(DBTable, self).__getattribute__(item)
 
-    def __getattr__(self, item):
-        return super(DBTable, self).__setattr__(item)
-
-    def __str__(self):
-        return f"TABLE = {str(self.__dict__)}"
-
-    def __repr__(self):
-        return str(self)
-
-    def __setitem__(self, key, value):
-        setattr(self, key, value)
+def decode_json(val):
+    # only the {"list": ...} / {"dict": ...} envelope is unwrapped, any other value is returned as stored
+    if type(val) not in (str, bytes) or not val.startswith("{" if type(val) is str else b"{"):
+        return val
+    try:
+        decoded = json.loads(val)
+    except ValueError:
+        return val
+    if type(decoded) == dict and len(decoded) == 1:
+        if "list" in decoded:
+            return decoded["list"]
+        if "dict" in decoded:
+            return decoded["dict"]
+    return val
 
 
 class SQLCommand(enum.Enum):
@@ -46,60 +68,311 @@ class SQLCommand(enum.Enum):
     where = "WHERE"
 
 
+class StatementCache:
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, build) -> str:
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is None:
+                self.misses += 1
+                statement = self._statements[key] = build()
+                if len(self._statements) > self.maxsize:
+                    self._statements.popitem(last=False)
+            else:
+                self.hits += 1
+                self._statements.move_to_end(key)
+            return statement
+
+    def clear(self):
+        self._statements.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._statements), "maxsize": self.maxsize}
+
+
+TableSchema = namedtuple("TableSchema", "columns primary_key foreign_key reference")
+
+
+class SchemaRegistry:
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def get(self, table: str) -> TableSchema:
+        return self._tables.get(table)
+
+    def known(self, table: str, columns: tuple) -> bool:
+        schema = self._tables.get(table)
+        return schema is not None and schema.columns == columns
+
+    def remember(self, table: str, schema: TableSchema):
+        with self._lock:
+            self._tables[table] = schema
+
+    def forget(self, table: str):
+        with self._lock:
+            self._tables.pop(table, None)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+
 class SQLExecutor:
-    def __init__(self, *args, **kwargs):
+    placeholder = "?"
+    _no_limit = "-1"
+    _zeroblob = "zeroblob(?)"
+    _json_extract = "json_extract({}, '{}')"
+
+    def __init__(self, *args, statement_cache_size: int = 128, **kwargs):
         self._is_conn = False
         self.db = None
         self._cursor = None
         self._buffer = None
+        self.statement_cache = StatementCache(statement_cache_size)
+        self._codecs = {}
+        self._described = {}
+        self._references = {}
+        self._ensured_indexes = set()
+        self.pool = None
+        self.schemas = SchemaRegistry()
+        self.advisor = None
+        self.result_cache = None
+        self.instrumentation = None
+        self.tracker = None
+        self._pending_event = None
 
     def __enter__(self):
         return SimpleSQL(self)
 
-    @staticmethod
-    def _adding_quot(values, columns):
-        values_ = []
-        new_cols =[]
-        for i, val in enumerate(values):
-            if list == type(val):
-                val = json.dumps({"list": val})
-            if dict == type(val):
-                val = json.dumps({"dict": val})
-            if val is None:
-                values_.append("null")
-            elif val == "AUTO_INC_VALUE":
+    def reset_state(self):
+        self.advisor = None
+        self.result_cache = None
+        self.instrumentation = None
+        self.tracker = None
+        self._pending_event = None
 
-                continue
+    @staticmethod
+    def _encode_value(val):
+        if list == type(val) or tuple == type(val):
+            # tuples come back as lists, JSON has one array type
+            return json.dumps({"list": val})
+        if dict == type(val):
+            return json.dumps({"dict": val})
+        return val
+
+    def _column_names(self, cursor) -> list:
+        ...
 
-            else:
-                values_.append("\'" + str(val) + "\'")
-            new_cols.append(columns[i])
+    def _describe_table(self, table: str) -> list:
+        ...
 
-        return new_cols, values_
+    def describe_table(self, table: str) -> list:
+        # [(column, declared type, is primary key)], in table order
+        described = self._described.get(table)
+        if described is None:
+            described = self._described[table] = self._describe_table(table)
+        return described
 
-    def _packing_query(self) -> Sequence:
+    def _referenced_tables(self, table: str) -> list:
         ...
 
+    def referenced_tables(self, table: str) -> list:
+        # tables the foreign keys of table point to, as declared in the database
+        referenced = self._references.get(table)
+        if referenced is None:
+            referenced = self._references[table] = self._referenced_tables(table)
+        return referenced
+
+    def table_columns(self, table: str) -> list:
+        return [column for column, _, _ in self.describe_table(table)]
+
+    def primary_key(self, table: str) -> [str, None]:
+        schema = self.schemas.get(table)
+        if schema is not None and schema.primary_key:
+            return schema.primary_key
+        keys = [column for column, _, pk in self.describe_table(table) if pk]
+        return keys[0] if len(keys) == 1 else None
+
+    def _object_columns(self, table: str) -> list:
+        return [column for column, type_, _ in self.describe_table(table) if SQLTypes.is_object_type(type_)]
+
+    @staticmethod
+    def _json_path(path: list) -> str:
+        # values are stored wrapped as {"list": [...]} / {"dict": {...}}, nested values as plain JSON
+        if not all(segment.isdigit() or segment.isidentifier() for segment in path):
+            raise ValueError(f"invalid JSON path \"{'.'.join(path)}\"")
+        res = "$.list" if path[0].isdigit() else "$.dict"
+        return res + "".join(f"[{segment}]" if segment.isdigit() else f".{segment}" for segment in path)
+
+    def column_sql(self, table: str, column: str) -> str:
+        # "details.price" on a JSON column -> extraction of that path, anything else is used as is
+        if "." not in column:
+            return column
+        name, *path = column.split(".")
+        if name not in self._object_columns(table):
+            return column
+        return self._json_extract.format(name, self._json_path(path))
+
+    def _index_column(self, table: str, column: str) -> str:
+        return self.column_sql(table, column)
+
+    def _forget_table(self, table: str):
+        self._codecs.pop(table, None)
+        self._described.pop(table, None)
+        self._references.pop(table, None)
+        self._ensured_indexes = {key for key in self._ensured_indexes if key[0] != table}
+
+    def column_codecs(self, table: str) -> dict:
+        codecs = self._codecs.get(table)
+        if codecs is None:
+            codecs = self._codecs[table] = {column: decode_json for column in self._object_columns(table)}
+        return codecs
+
+    def register_codec(self, table: str, column: str, decode: Callable = decode_json):
+        self.column_codecs(table)[column] = decode
+
+    @staticmethod
+    def _packing_rows(names: list, rows: Iterable[tuple], row_factory: Callable = None,
+                      codecs: dict = None) -> Iterable:
+        # the row constructor and the decoded columns are resolved once per result set, not per row
+        make = (row_factory or _row_type)(tuple(names))
+        if row_factory is None:
+            make = make._make
+        decoders = [(i, codecs[name]) for i, name in enumerate(names) if name in codecs] if codecs else None
+        if not decoders:
+            for cols in rows:
+                yield make(cols)
+            return
+        for cols in rows:
+            values = list(cols)
+            for i, decode in decoders:
+                if values[i] is not None:
+                    values[i] = decode(values[i])
+            yield make(values)
+
+    def _packing_query(self, row_factory: Callable = None, codecs: dict = None) -> Sequence:
+        event, self._pending_event = self._pending_event, None
+        if event is None or self.instrumentation is None:
+            return list(self._packing_rows(self._column_names(self._cursor), self._cursor.fetchall(),
+                                           row_factory, codecs))
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        fetched = time.perf_counter()
+        res = list(self._packing_rows(self._column_names(self._cursor), rows, row_factory, codecs))
+        event.driver += fetched - started
+        event.materialize += time.perf_counter() - fetched
+        event.rows = len(res)
+        self.instrumentation.end(self, event)
+        return res
+
     def execute_select(self, table,
                        columns: [Iterable[str], str] = "*",
                        sorted_: str = None,
                        distinct: bool = False,
                        condition: str = "",
-                       first: bool = False):
+                       first: bool = False,
+                       params: Sequence = None,
+                       row_factory: Callable = None,
+                       limit: int = None,
+                       offset: int = None,
+                       group_by: Iterable[str] = None):
+        codecs = self.column_codecs(table)
+        statement = self._cached_select(table, columns, sorted_, distinct, condition, first, limit, offset,
+                                        group_by)
+        self.execute(statement, self._page_params(params, first, limit, offset))
+
+        return self._packing_query(row_factory, codecs)
+
+    def execute_select_iter(self, table,
+                            columns: [Iterable[str], str] = "*",
+                            sorted_: str = None,
+                            condition: str = "",
+                            params: Sequence = None,
+                            chunk_size: int = 1000,
+                            row_factory: Callable = None) -> Iterable:
+        statement = self._cached_select(table, columns, sorted_, False, condition, False, None, None)
+        codecs = self.column_codecs(table)
+        # own cursor, so other statements issued while iterating don't reset the result set
+        cursor = self.db.cursor()
+        event = None
+        try:
+            event = self._execute_on(cursor, statement, params)
+            names = self._column_names(cursor)
+            while True:
+                started = time.perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                if event is not None:
+                    event.driver += time.perf_counter() - started
+                    event.rows = (event.rows or 0) + len(rows)
+                if not rows:
+                    return
+                if event is None:
+                    yield from self._packing_rows(names, rows, row_factory, codecs)
+                    continue
+                started = time.perf_counter()
+                packed = list(self._packing_rows(names, rows, row_factory, codecs))
+                event.materialize += time.perf_counter() - started
+                yield from packed
+        finally:
+            cursor.close()
+            if event is not None and self.instrumentation is not None:
+                self.instrumentation.end(self, event)
+
+    def _cached_select(self, table, columns, sorted_, distinct, condition, first, limit, offset,
+                       group_by: Iterable[str] = None) -> str:
         if columns != "*":
-            columns = ", ".join(columns)[1:]
-        if condition:
-            condition = f"{SQLCommand.where.value} {condition}"
-        if not sorted_:
-            sorted_ = ""
-        if not first:
-            first = ""
+            columns = tuple(columns)
+        group_by = tuple(group_by) if group_by else None
+        # limit and offset values are bound, only their presence is part of the template
+        limit, offset = limit is not None, bool(offset)
+        return self.statement_cache.get(
+            ("select", table, columns, sorted_, distinct, condition, first, limit, offset, group_by),
+            lambda: self._select_statement(table, columns, sorted_, distinct, condition, first, limit, offset,
+                                           group_by))
+
+    def _select_statement(self, table, columns, sorted_, distinct, condition, first, limit, offset,
+                          group_by: tuple = None) -> str:
+        if columns != "*":
+            columns = ", ".join(columns)
+        distinct = f"{SQLCommand.distinct.value} " if distinct else ""
+        condition = f" {SQLCommand.where.value} {condition}" if condition else ""
+        if group_by:
+            condition += f" GROUP BY {', '.join(group_by)}"
+        sorted_ = f" {sorted_}" if sorted_ else ""
+        if first:
+            page = " LIMIT 1"
+        elif limit or offset:
+            page = f" LIMIT {self.placeholder if limit else self._no_limit}"
+            if offset:
+                page += f" OFFSET {self.placeholder}"
         else:
-            first = "LIMIT 1"
+            page = ""
+        return f"{SQLCommand.select.value} {distinct}{columns} FROM {table}{condition}{sorted_}{page};"
 
-        self.execute(f"{SQLCommand.select.value} {columns} FROM {table} {sorted_} {condition} {first} ;")
-
-        return self._packing_query()
+    @staticmethod
+    def _page_params(params: Sequence, first: bool, limit: int, offset: int) -> Sequence:
+        if first or (limit is None and not offset):
+            return params
+        params = tuple(params or ())
+        if limit is not None:
+            params += (limit,)
+        if offset:
+            params += (offset,)
+        return params
+
+    def _insert_statement(self, table, columns: tuple) -> str:
+        return self.statement_cache.get(
+            ("insert", table, columns),
+            lambda: f"{SQLCommand.insert.value} {SQLCommand.into.value} {table} ({','.join(columns)})"
+                    f" VALUES ({','.join([self.placeholder] * len(columns))})")
 
     def execute_create_db(self, name: str):
         self.execute(f"CREATE DATABASE {name};")
@@ -109,19 +382,65 @@ class SQLExecutor:
         ...
 
     def execute_insert(self, table, columns: tuple, values: tuple):
-        columns, values = self._adding_quot(values, columns)
-        cols = f'({str(",").join(columns)})'
-        vals = f'({str(",").join(values)})'
-
-        self._cursor.execute(f"{SQLCommand.insert.value} {SQLCommand.into.value} {table}"
-                             f" {cols} VALUES {vals};")
+        keep = [i for i, val in enumerate(values) if val != "AUTO_INC_VALUE"]
+        statement = self._insert_statement(table, tuple(columns[i] for i in keep))
+        self.execute(statement, tuple(self._encode_value(values[i]) for i in keep))
+
+    def execute_insert_many(self, table, columns: tuple, rows: Iterable[tuple], batch_size: int = 1000,
+                            key: tuple = None) -> int:
+        everything = tuple(range(len(columns)))
+
+        def shape(values) -> tuple:
+            if "AUTO_INC_VALUE" not in values:
+                return everything
+            return tuple(i for i, val in enumerate(values) if val != "AUTO_INC_VALUE")
+
+        encode = self._encode_value
+        count = 0
+        # rows of one statement must agree on which columns are left to AUTO_INC, a change starts a new one
+        for keep, group in itertools.groupby(rows, key=shape):
+            kept = tuple(columns[i] for i in keep)
+            statement = self._insert_statement(table, kept)
+            suffix = self._upsert_clause(table, kept, key) if key else ""
+            while True:
+                batch = [tuple(encode(values[i]) for i in keep) for values in itertools.islice(group, batch_size)]
+                if not batch:
+                    break
+                self._execute_insert_batch(statement, batch, suffix)
+                count += len(batch)
+        return count
+
+    def _execute_insert_batch(self, statement, batch: list, suffix: str = ""):
+        self._execute_many(statement + suffix, batch)
+
+    def _upsert_clause(self, table, columns: tuple, key: tuple) -> str:
+        updates = tuple(c for c in columns if c not in key)
+        return self.statement_cache.get(
+            ("upsert", table, columns, key),
+            lambda: f" ON CONFLICT ({','.join(key)}) DO "
+                    + (f"UPDATE SET {','.join(f'{c} = excluded.{c}' for c in updates)}" if updates else "NOTHING"))
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.release(self)
+        else:
+            self.close()
+
+    def close(self):
         if self._is_conn:
             self._cursor.close()
             self.db.close()
             self._is_conn = False
 
+    def ping(self) -> bool:
+        try:
+            self.execute("SELECT 1")
+            self._cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
     def start(self):
         return self.__enter__()
 
@@ -136,19 +455,67 @@ class SQLExecutor:
         reference = f" REFERENCES {reference[0]}({reference[1]}){ondelete}{onupdate}"   if reference else ""
 
         self.execute(f"CREATE TABLE IF NOT EXISTS {name} ({str(',').join(columns)}{primary}{foreign_key}{reference});")
+        self._forget_table(name)
 
     def stop(self):
         self.__exit__(None, None, None)
 
     def execute_delete_by(self, table, column, value):
-        self.execute(f"DELETE FROM {table} WHERE {column} = \"{value}\";")
+        statement = self.statement_cache.get(
+            ("delete", table, f"{column} = {self.placeholder}"),
+            lambda: f"DELETE FROM {table} WHERE {column} = {self.placeholder};")
+        self.execute(statement, (self._encode_value(value),))
+
+    def execute_delete_if_equal(self, table, statement, params: Sequence = None):
+        statement = self.statement_cache.get(("delete", table, statement),
+                                             lambda: f"DELETE FROM {table} WHERE {statement};")
+        self.execute(statement, params)
+
+    def execute_create_index(self, table: str, columns: tuple, name: str, unique: bool = False):
+        # JSON paths become expression indexes, matched by the identical expression in WHERE
+        unique = "UNIQUE " if unique else ""
+        columns = [self._index_column(table, column) for column in columns]
+        self.execute(f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {table} ({','.join(columns)});")
+
+    def execute_drop_index(self, table: str, name: str):
+        self.execute(f"DROP INDEX IF EXISTS {name};")
+
+    def explain(self, statement: str, params: Sequence = None) -> list:
+        cursor = self.db.cursor()
+        try:
+            self._execute_on(cursor, f"{self._explain} {statement}", params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def plan_scans(self, plan: list) -> bool:
+        ...
+
+    def _blob_key(self, table: str) -> str:
+        key_column = self.primary_key(table)
+        if key_column is None:
+            raise ValueError(f"blob access needs a primary key on \"{table}\"")
+        return key_column
+
+    _substring = "SUBSTRING"
 
-    def execute_delete_if_equal(self, table, statement):
+    def _splice(self, column: str, offset: int, data: bytes) -> tuple[str, tuple]:
+        # -> (SQL of column with len(data) bytes at offset replaced by data, its params)
+        ph = self.placeholder
+        return f"INSERT({column}, {ph}, {ph}, {ph})", (offset + 1, len(data), data)
 
-        self.execute(f"DELETE FROM {table} WHERE {statement};")
+    def open_blob(self, table: str, column: str, key, readonly: bool = True):
+        return ChunkedBlob(self, table, column, self._blob_key(table), key, readonly)
+
+    def execute_reserve_blob(self, table: str, column: str, key, size: int):
+        # a blob can't grow while it is open, so its final size is written up front
+        key_column = self._blob_key(table)
+        self.execute(f"UPDATE {table} SET {column} = {self._zeroblob} WHERE {key_column} = {self.placeholder};",
+                     (size, self._encode_value(key)))
 
     def execute_drop_table(self, table: str):
         self.execute(f"DROP TABLE IF EXISTS {table}")
+        self._forget_table(table)
 
     def execute_increment_value(self, name: str, val: int):
         ...
@@ -161,93 +528,186 @@ class SQLExecutor:
         self.execute(f"BACKUP DATABASE {database} TO DISK = '{filepath}'{diff_};")
 
     def execute_update_table(self, table, data,prime_indexes:str=None, condition=None,
-                             filters: list[tuple] = None, foreign_key=False):
-        if foreign_key:
-            self.execute("PRAGMA foreign_keys = ON;")
+                             filters: list[tuple] = None, foreign_key=False, params: Sequence = ()):
         if not filters:
-            res = []
-            for c, v in data.__dict__.items():
-                if c == prime_indexes:
-                    continue
-                if dict == type(v):
-
-                    res.append(f"{c} = \'{json.dumps({'dict': v})}\'")
-                elif list == type(v):
-                    res.append(f"{c} = \'{json.dumps({'list': v})}\'")
-                else:
-                    res.append(f"{c} = \'{v}\'")
-
-            filters_parse = res
+            pairs = [(c, v) for c, v in data.__dict__.items() if c != prime_indexes]
         else:
-
-            filters_parse = [f"{c} = \'{v}\'" for c, v in data.__dict__.items() if data.__dict__[c] != v]
-
+            # only the given (column, value) pairs are written
+            pairs = list(filters)
 
         if condition:
-            condition = f" WHERE {condition}"
+            params = tuple(params)
         else:
+            column, value = pairs.pop(0)
+            condition = f"{column} = {self.placeholder}"
+            params = (self._encode_value(value),)
+
+        statement = self._update_statement(table, tuple(c for c, _ in pairs), condition)
+        self.execute(statement, tuple(self._encode_value(v) for _, v in pairs) + params)
+
+    def _update_statement(self, table, columns: tuple, condition: str) -> str:
+        return self.statement_cache.get(
+            ("update", table, columns, condition),
+            lambda: f"UPDATE {table} SET {','.join(f'{c} = {self.placeholder}' for c in columns)}"
+                    f" WHERE {condition};")
+
+    def execute_update_many(self, table, columns: tuple, where: str, rows: Iterable[tuple]):
+        # each row holds the new values of columns followed by the value of where
+        statement = self._update_statement(table, columns, f"{where} = {self.placeholder}")
+        self._execute_many(statement, [tuple(map(self._encode_value, row)) for row in rows])
+
+    def execute_delete_in(self, table, column: str, values: Iterable, batch_size: int = 500) -> int:
+        # one DELETE ... IN (...) per batch, the last (shorter) batch gets its own cached statement
+        values = iter(values)
+        count = 0
+        while True:
+            batch = tuple(map(self._encode_value, itertools.islice(values, batch_size)))
+            if not batch:
+                return count
+            self.execute_delete_if_equal(table, f"{column} IN ({','.join([self.placeholder] * len(batch))})", batch)
+            count += max(self._cursor.rowcount, 0)
+
+    def execute_delete_many(self, table, statement: str, rows: Iterable[Sequence]):
+        statement = self.statement_cache.get(("delete", table, statement),
+                                             lambda: f"DELETE FROM {table} WHERE {statement};")
+        self._execute_many(statement, [tuple(row) for row in rows])
+
+    def execute(self, statement, params: Sequence = None):
+        if self._pending_event is not None:
+            # the rows of the previous statement were read directly from the cursor
+            pending, self._pending_event = self._pending_event, None
+            if self.instrumentation is not None:
+                self.instrumentation.end(self, pending)
+        self._pending_event = self._execute_on(self._cursor, statement, params)
+
+    def _execute_on(self, cursor, statement, params: Sequence = None):
+        # -> None, or the instrumentation event of a query, finished once its rows are fetched
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            self._run(cursor, statement, params)
+            return None
+        event = instrumentation.begin(statement, params)
+        started = time.perf_counter()
+        try:
+            self._run(cursor, statement, params)
+        finally:
+            event.driver = time.perf_counter() - started
+        if cursor.description is not None:
+            return event
+        event.rows = cursor.rowcount
+        instrumentation.end(self, event)
+        return None
 
-            condition = f" WHERE {filters_parse.pop(0)}"
-
-
-        self.execute(f"UPDATE {table} SET {','.join(filters_parse)}{condition};")
-
-    def execute(self, statement):
-        self._cursor.execute(statement)
+    @staticmethod
+    def _run(cursor, statement, params: Sequence = None):
+        if params:
+            cursor.execute(statement, params)
+        else:
+            cursor.execute(statement)
+
+    def _execute_many(self, statement, rows: list):
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            self._cursor.executemany(statement, rows)
+            return
+        # the first row stands for the batch, the slow log must not keep whole batches alive
+        event = instrumentation.begin(statement, rows[:1])
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(statement, rows)
+        finally:
+            event.driver = time.perf_counter() - started
+        event.rows = self._cursor.rowcount
+        instrumentation.end(self, event)
 
     def databases(self):
         ...
 
 
 class SQLServerLess(SQLExecutor):
-    def __init__(self, *args, **kwargs):
+    profiles = {
+        "fast": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -64000,
+                 "mmap_size": 268435456, "temp_store": "MEMORY", "busy_timeout": 5000},
+        "safe": {"journal_mode": "WAL", "synchronous": "FULL", "cache_size": -16000,
+                 "mmap_size": 0, "temp_store": "DEFAULT", "busy_timeout": 5000},
+    }
+
+    def __init__(self, *args, statement_cache_size: int = 128, profile: [str, dict] = None, **kwargs):
 
         import sqlite3
-        super().__init__(*args, **kwargs)
+        super().__init__(statement_cache_size=statement_cache_size)
+        pragmas = self._profile_pragmas(profile)
+        kwargs.setdefault("cached_statements", statement_cache_size)
         self.db = sqlite3.connect(*args, **kwargs)
         self._cursor = self.db.cursor()
         self._is_conn = True
-
-    def execute_insert(self, table, columns: tuple, values: tuple):
-        self.execute("PRAGMA foreign_keys = ON;")
-        super(SQLServerLess, self).execute_insert(table, columns, values)
-
-    def execute_delete_by(self, table, column, value):
-        self.execute("PRAGMA foreign_keys = ON;")
-        super(SQLServerLess, self).execute_delete_by(table, column, value)
-
-    def execute_delete_if_equal(self, table, statement):
-        self.execute("PRAGMA foreign_keys = ON;")
-        super(SQLServerLess, self).execute_delete_if_equal(table, statement)
-
-    def execute_create_table(self, name: str, columns: tuple, primary, foreign_key: str = "",
-                             reference: tuple = None,on_delete=False,on_update=False):
-        if foreign_key:
-            self.execute("PRAGMA foreign_keys = ON;")
-
-        super(SQLServerLess, self).execute_create_table(name, columns, primary,
-                                                        foreign_key, reference,
-                                                        on_delete,on_update)
-
-    def _packing_query(self):
-        names = list(map(lambda x: x[0], self._cursor.description))
-        res = []
-        for cols in self._cursor.fetchall():
-            t = DBTable()
-
-            for i, col in enumerate(names):
-                if type(cols[i]) == str:
-                    if '{"list": ' in cols[i]:
-                        t[col] = json.loads(cols[i])['list']
-                    elif '{"dict": ' in cols[i]:
-                        t[col] = json.loads(cols[i])['dict']
-                    else:
-                        t[col] = cols[i]
-                else:
-                    t[col] = cols[i]
-
-            res.append(t)
-        return res
+        # connection level settings, applied once instead of before every statement
+        for name, value in pragmas.items():
+            self.execute(f"PRAGMA {name} = {value};")
+
+    def _profile_pragmas(self, profile: [str, dict] = None) -> dict:
+        pragmas = {"foreign_keys": "ON"}
+        if isinstance(profile, str):
+            if profile not in self.profiles:
+                raise ValueError(f"unknown sqlite profile \"{profile}\", expected one of {list(self.profiles)}")
+            pragmas.update(self.profiles[profile])
+        elif profile:
+            pragmas.update(profile)
+        return pragmas
+
+    _explain = "EXPLAIN QUERY PLAN"
+
+    def _column_names(self, cursor) -> list:
+        return [d[0] for d in cursor.description]
+
+    def explain(self, statement: str, params: Sequence = None) -> list:
+        # sqlite3 caches prepared statements by their text, and a cached EXPLAIN is not re-planned
+        # after CREATE/DROP INDEX, so the schema version becomes part of the text
+        cursor = self.db.cursor()
+        try:
+            version = cursor.execute("PRAGMA schema_version;").fetchone()[0]
+            return super(SQLServerLess, self).explain(f"{statement} /* schema {version} */", params)
+        finally:
+            cursor.close()
+
+    def plan_scans(self, plan: list) -> bool:
+        # (id, parent, notused, detail), e.g. "SCAN Orders" vs "SEARCH Orders USING INDEX ..."
+        return any(row[3].startswith("SCAN") and "USING" not in row[3] for row in plan)
+
+    def _blob_key(self, table: str) -> str:
+        return "rowid"
+
+    _substring = "substr"
+
+    def _splice(self, column: str, offset: int, data: bytes) -> tuple[str, tuple]:
+        # || yields TEXT, the cast keeps the bytes as they are
+        return f"CAST(substr({column}, 1, ?) || ? || substr({column}, ?) AS BLOB)", \
+            (offset, data, offset + len(data) + 1)
+
+    def open_blob(self, table: str, column: str, key, readonly: bool = True):
+        # incremental I/O straight from the database pages, key is the rowid (the INTEGER PRIMARY KEY);
+        # Connection.blobopen is new in Python 3.11, older versions move chunks with SQL
+        if not hasattr(self.db, "blobopen"):
+            return super(SQLServerLess, self).open_blob(table, column, key, readonly)
+        return self.db.blobopen(table, column, key, readonly=readonly)
+
+    def _describe_table(self, table: str) -> list:
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"PRAGMA table_info({table});")
+            # (cid, name, type, notnull, dflt_value, pk)
+            return [(row[1], row[2], bool(row[5])) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _referenced_tables(self, table: str) -> list:
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"PRAGMA foreign_key_list({table});")
+            # (id, seq, table, from, to, on_update, on_delete, match)
+            return sorted({row[2] for row in cursor.fetchall()})
+        finally:
+            cursor.close()
 
     def execute_increment_value(self, name: str, val: int):
         self.execute(f"ALTER TABLE {name} AUTOINCREMENT={val};")
@@ -264,9 +724,103 @@ class SQLServerLess(SQLExecutor):
         os.remove(name + ".db")
 
 
+class ThreadLocalSQLServerLess(SQLServerLess):
+    # one lazily opened connection (and cursor) per thread, so threads never share a cursor or a transaction;
+    # WAL lets readers run while another thread writes, busy_timeout makes concurrent writers wait their turn.
+    # Reads and writes of a thread share its connection instead of going to a separate writer: a thread has to
+    # read its own uncommitted writes, and SQLite allows a single writer at a time either way
+    def __init__(self, *args, statement_cache_size: int = 128, profile: [str, dict] = None, **kwargs):
+        SQLExecutor.__init__(self, statement_cache_size=statement_cache_size)
+        database = kwargs.get("database", args[0] if args else None)
+        if database is None or database == ":memory:" or "mode=memory" in str(database):
+            raise ValueError("per-thread connections need a database file, each would get its own :memory:")
+        self._pragmas = {"journal_mode": "WAL", "busy_timeout": 5000, **self._profile_pragmas(profile)}
+        kwargs.setdefault("cached_statements", statement_cache_size)
+        # connections are closed by stop(), which may run on another thread
+        kwargs["check_same_thread"] = False
+        self._connect_args = args
+        self._connect_kwargs = kwargs
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._is_conn = True
+        self._local_connection()
+
+    def _local_connection(self):
+        local = self._local
+        if getattr(local, "connection", None) is None:
+            import sqlite3
+            connection = sqlite3.connect(*self._connect_args, **self._connect_kwargs)
+            cursor = connection.cursor()
+            for name, value in self._pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value};")
+                cursor.fetchall()
+            local.connection, local.cursor = connection, cursor
+            thread = threading.current_thread()
+            with self._connections_lock:
+                # threads of a thread-per-request server come and go, their connections go with them
+                for dead in [t for t in self._connections if not t.is_alive()]:
+                    self._close_connection(*self._connections.pop(dead))
+                self._connections[thread] = (connection, cursor)
+        return local
+
+    @property
+    def _local(self) -> threading.local:
+        local = self.__dict__.get("_thread_local")
+        if local is None:
+            local = self.__dict__["_thread_local"] = threading.local()
+        return local
+
+    @property
+    def db(self):
+        return self._local_connection().connection if self._is_conn else None
+
+    @db.setter
+    def db(self, value):
+        pass
+
+    @property
+    def _cursor(self):
+        return self._local_connection().cursor if self._is_conn else None
+
+    @_cursor.setter
+    def _cursor(self, value):
+        pass
+
+    @property
+    def _pending_event(self):
+        return getattr(self._local, "pending_event", None)
+
+    @_pending_event.setter
+    def _pending_event(self, value):
+        self._local.pending_event = value
+
+    @staticmethod
+    def _close_connection(connection, cursor):
+        cursor.close()
+        connection.close()
+
+    def close(self):
+        if not self._is_conn:
+            return
+        self._is_conn = False
+        with self._connections_lock:
+            connections, self._connections = self._connections, {}
+        for connection, cursor in connections.values():
+            self._close_connection(connection, cursor)
+
+    def connections(self) -> int:
+        with self._connections_lock:
+            return len(self._connections)
+
+
 class SQLServer(SQLExecutor):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    placeholder = "%s"
+    _no_limit = "18446744073709551615"
+    _zeroblob = "REPEAT(CHAR(0), %s)"
+    _json_extract = "JSON_UNQUOTE(JSON_EXTRACT({}, '{}'))"
+
+    def __init__(self, *args, statement_cache_size: int = 128, **kwargs):
+        super().__init__(statement_cache_size=statement_cache_size)
         if kwargs.get("create_and_ignore", None):
             self._auto_create_and_ignore(*args, **kwargs)
         else:
@@ -276,6 +830,26 @@ class SQLServer(SQLExecutor):
     def execute_drop_db(self, name: str):
         self.execute(f"DROP DATABASE {name};")
 
+    @staticmethod
+    def _encode_value(val):
+        # the driver binds bytes and bytearray but not other buffers
+        if type(val) is memoryview:
+            return val.tobytes()
+        return SQLExecutor._encode_value(val)
+
+    def _execute_insert_batch(self, statement, batch: list, suffix: str = ""):
+        # one multi-row VALUES statement per batch instead of a round trip per row
+        head, row = statement.rsplit(" VALUES ", 1)
+        self.execute(f"{head} VALUES {','.join([row] * len(batch))}{suffix}",
+                     [val for values in batch for val in values])
+
+    def _upsert_clause(self, table, columns: tuple, key: tuple) -> str:
+        # MySQL resolves the conflict on whichever unique key is hit, key only decides what isn't overwritten
+        updates = tuple(c for c in columns if c not in key) or key[:1]
+        return self.statement_cache.get(
+            ("upsert", table, columns, key),
+            lambda: f" ON DUPLICATE KEY UPDATE {','.join(f'{c} = VALUES({c})' for c in updates)}")
+
     def execute_increment_value(self, name: str, val: int):
         self.execute(f"ALTER TABLE {name} AUTO_INCREMENT={val};")
 
@@ -296,24 +870,76 @@ class SQLServer(SQLExecutor):
         self.db = mysql.connector.connect(*args, **kwargs)
         self._cursor = self.db.cursor()
 
-    def _packing_query(self):
-        res = []
-
-        for cols in self._cursor.fetchall():
-            t = DBTable()
-            for i, col in enumerate(self._cursor.column_names):
-
-                if type(cols[i]) == str:
-                    if '{"list": ' in cols[i]:
-                        t[col] = json.loads(cols[i])['list']
-                    elif '{"dict": ' in cols[i]:
-                        t[col] = json.loads(cols[i])['dict']
-                    else:
-                        t[col] = cols[i]
-                else:
-                    t[col] = cols[i]
-            res.append(t)
-        return res
+    _explain = "EXPLAIN"
+
+    def _column_names(self, cursor) -> list:
+        return list(cursor.column_names)
+
+    def plan_scans(self, plan: list) -> bool:
+        # the access type column is "ALL" for a full table scan
+        return any(row[4] == "ALL" for row in plan)
+
+    def _index_exists(self, table: str, name: str) -> bool:
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s;", (name,))
+            return bool(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def execute_create_index(self, table: str, columns: tuple, name: str, unique: bool = False):
+        # MySQL has no CREATE INDEX IF NOT EXISTS
+        if not self._index_exists(table, name):
+            unique = "UNIQUE " if unique else ""
+            columns = [self._index_column(table, column) for column in columns]
+            self.execute(f"CREATE {unique}INDEX {name} ON {table} ({','.join(columns)});")
+
+    def _index_column(self, table: str, column: str) -> str:
+        # JSON paths are indexed through an invisible generated column (hidden from SELECT *),
+        # the optimizer uses it for WHERE clauses with the same expression
+        expression = self.column_sql(table, column)
+        if expression == column:
+            return column
+        generated = column.replace(".", "__")
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"SHOW COLUMNS FROM {table} LIKE %s;", (generated,))
+            exists = bool(cursor.fetchall())
+        finally:
+            cursor.close()
+        if not exists:
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {generated} VARCHAR(255) "
+                         f"GENERATED ALWAYS AS ({expression}) VIRTUAL INVISIBLE;")
+        return generated
+
+    def execute_drop_index(self, table: str, name: str):
+        if self._index_exists(table, name):
+            self.execute(f"DROP INDEX {name} ON {table};")
+
+    def _describe_table(self, table: str) -> list:
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"SHOW COLUMNS FROM {table};")
+            # (Field, Type, Null, Key, Default, Extra)
+            res = []
+            for row in cursor.fetchall():
+                if "INVISIBLE" in (row[5] or "").upper():
+                    continue
+                type_ = row[1].decode() if isinstance(row[1], bytes) else row[1]
+                res.append((row[0], type_, row[3] == "PRI"))
+            return res
+        finally:
+            cursor.close()
+
+    def _referenced_tables(self, table: str) -> list:
+        cursor = self.db.cursor()
+        try:
+            cursor.execute("SELECT DISTINCT REFERENCED_TABLE_NAME FROM information_schema.KEY_COLUMN_USAGE "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+                           "AND REFERENCED_TABLE_NAME IS NOT NULL;", (table,))
+            return sorted(row[0].decode() if isinstance(row[0], bytes) else row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
 
     def databases(self) -> list:
         self.execute("show databases")
@@ -349,6 +975,14 @@ class SQLTypes:
             return SQLTypes.text(max_size)
         return SQLTypes.text(long=True)
 
+    @staticmethod
+    def is_object_type(type_: str) -> bool:
+        # text columns may hold the {"list": ...} / {"dict": ...} envelope written by objType() columns
+        # (LONGTEXT, TEXT(n), reported as TINYTEXT/TEXT/... by MySQL), JSON/JSON_TEXT for tables declared as JSON;
+        # VARCHAR, numeric and binary columns are never decoded
+        type_ = type_.upper()
+        return type_.startswith("JSON") or type_.endswith("TEXT") or type_.startswith("TEXT(")
+
     @staticmethod
     def integer():
         return f"INTEGER"
@@ -357,6 +991,12 @@ class SQLTypes:
     def image(max:int=100):
         return f"VARBINARY({max})"
 
+    @staticmethod
+    def blob(long: bool = False):
+        if long:
+            return "LONGBLOB"
+        return "BLOB"
+
 
     @staticmethod
     def varchar(size: int, ):
@@ -382,6 +1022,20 @@ class SQLTypes:
         return f"{d_type}{nullable}{auto_increment}{unique}"
 
 
+def _operation(method):
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self._executor.instrumentation
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        with instrumentation.operation(name):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class SimpleSQL:
     AUTO_INC = "AUTO_INC_VALUE"
 
@@ -403,6 +1057,12 @@ class SimpleSQL:
     def commit(self):
         self._executor.db.commit()
 
+    def rollback(self):
+        # cached results may hold rows written by the rolled back transaction
+        self._executor.db.rollback()
+        if self._executor.result_cache is not None:
+            self._executor.result_cache.clear()
+
     def set_auto_commit(self, val: bool):
         self._executor.db.autocommit = val
 
@@ -428,6 +1088,7 @@ class SimpleSQL:
         else:
             raise DatabaseExist(f"database named \"{name}\" is already created.")
 
+    @_operation
     def create_table(self, table: type, data, primary_key: str = None,
                      auto_increment_value: int = None,
                      foreign_key: str = None,
@@ -439,54 +1100,382 @@ class SimpleSQL:
                                                 primary_key,foreign_key,
                                                 reference=reference,on_delete=ondelete,on_update=onupdate
                                               )
+        self._executor.schemas.remember(table.__name__, TableSchema(tuple(data.__dict__), primary_key,
+                                                                    foreign_key, reference))
 
 
         if auto_increment_value and not self._types._server_less:
             self._executor.execute_increment_value(table.__name__, auto_increment_value)
 
-    def query_filters(self, table: type, filters: str, first: bool = False):
-        result = self._executor.execute_select(table.__name__, condition=filters)
+    @staticmethod
+    def _model_factory(table: type, partial: bool = False, loader: DeferredLoader = None,
+                       tracker: ChangeTracker = None) -> Callable:
+        if not partial and loader is None:
+            def factory(names):
+                if tracker is None:
+                    return lambda values: table(**dict(zip(names, values)))
+
+                def make(values):
+                    instance = table(**dict(zip(names, values)))
+                    tracker.track(instance)
+                    return instance
+                return make
+            return factory
+
+        # models without every column can't go through __init__
+        model = deferred_type(table, loader) if loader is not None else table
+
+        def factory(names):
+            def make(values):
+                instance = model.__new__(model)
+                instance.__dict__.update(zip(names, values))
+                if loader is not None:
+                    loader.track(instance)
+                if tracker is not None:
+                    tracker.track(instance)
+                return instance
+            return make
+        return factory
+
+    def _projection(self, table: type, columns: Iterable[str] = None, defer: Iterable[str] = None,
+                    window: int = None) -> tuple:
+        # -> (selected columns or "*", row factory)
+        tracker = self._executor.tracker
+        if not columns and not defer:
+            return "*", self._model_factory(table, tracker=tracker)
+        name = table.__name__
+        columns = list(columns or self._executor.table_columns(name))
+        if not defer:
+            return columns, self._model_factory(table, partial=True, tracker=tracker)
+        primary_key = self._executor.primary_key(name)
+        if primary_key is None:
+            raise ValueError(f"deferred columns need a primary key on \"{name}\"")
+        defer = tuple(column for column in defer if column != primary_key)
+        columns = [column for column in columns if column not in defer]
+        if primary_key not in columns:
+            columns.insert(0, primary_key)
+        return columns, self._model_factory(table, loader=DeferredLoader(self._executor, name, primary_key, defer,
+                                                                           window=window),
+                                            tracker=tracker)
+
+    def _select(self, table: type, first: bool = False, condition: str = "", params: Sequence = None,
+                sorted_: str = None, limit: int = None, offset: int = None,
+                columns: Iterable[str] = None, defer: Iterable[str] = None) -> list:
+        cache = self._executor.result_cache
+        columns, factory = self._projection(table, columns, defer)
+        if cache is None:
+            return self._executor.execute_select(table.__name__, columns=columns, sorted_=sorted_,
+                                                 condition=condition, first=first, params=params,
+                                                 row_factory=factory, limit=limit, offset=offset)
+
+        key = (table.__name__, tuple(columns), " ".join(condition.split()), tuple(params or ()), first, sorted_,
+               limit, offset)
+        hit = cache.get(key)
+        if hit is None:
+            names = []
+
+            def capture(columns):
+                names.extend(columns)
+                return tuple
+
+            rows = self._executor.execute_select(table.__name__, columns=columns, sorted_=sorted_,
+                                                 condition=condition, first=first, params=params,
+                                                 row_factory=capture, limit=limit, offset=offset)
+            hit = (tuple(names), rows)
+            cache.put(table.__name__, key, *hit)
+        names, rows = hit
+        make = factory(names)
+        # list/dict cells are copied so callers can't mutate the cached rows
+        return [make([copy.deepcopy(v) if type(v) in (list, dict) else v for v in row]) for row in rows]
+
+    def _invalidate(self, table: Union[str, type]):
+        if self._executor.result_cache is not None:
+            self._executor.result_cache.invalidate(table.__name__ if not isinstance(table, str) else table)
+
+    def enable_result_cache(self, max_entries: int = 1024, max_bytes: int = 64 * 2 ** 20,
+                            ttl: float = None) -> ResultCache:
+        self._executor.result_cache = ResultCache(max_entries, max_bytes, ttl)
+        return self._executor.result_cache
+
+    def _where(self, filters: [str, Expr, None], table: type = None) -> tuple[str, Sequence]:
+        if isinstance(filters, Expr):
+            column = functools.partial(self._executor.column_sql, table.__name__) if table is not None else None
+            condition, params = filters.compile(self._executor.placeholder, column)
+            return condition, tuple(map(self._executor._encode_value, params))
+        return filters or "", None
+
+    @_operation
+    def query_filters(self, table: type, filters: [str, Expr], first: bool = False, limit: int = None,
+                      offset: int = None, columns: Iterable[str] = None, defer: Iterable[str] = None):
+        condition, params = self._where(filters, table)
+        result = self._select(table, condition=condition, params=params, limit=limit, offset=offset,
+                              columns=columns, defer=defer)
         if not result:
             return None
-        return [table(**item.__dict__) for item in result] if not first else table(**result[0].__dict__)
-
-    def query_filter_by(self, table: type, filter_: str, filter_value: Any, first=False):
-          if type(filter_value) == list:
-            filter_value=json.dumps({"list":filter_value})
-        elif type(filter_value) == dict:
-            filter_value = json.dumps({"dict": filter_value})
-        result = self._executor.execute_select(table.__name__, condition=f"{filter_} = \'{filter_value}\'", first=first)
+        return result if not first else result[0]
+
+    @_operation
+    def query_filter_by(self, table: type, filter_: str, filter_value: Any, first=False,
+                        columns: Iterable[str] = None, defer: Iterable[str] = None):
+        started = time.perf_counter()
+        filter_value = self._executor._encode_value(filter_value)
+        column = self._executor.column_sql(table.__name__, filter_)
+        result = self._select(table, condition=f"{column} = {self._executor.placeholder}", first=first,
+                              params=(filter_value,), columns=columns, defer=defer)
+        self._advise(table, filter_, started, filter_value)
         if not result:
             return None
-        return [table(**item.__dict__) for item in result] if not first else table(**result[0].__dict__)
-
-    def query_all(self, table: type):
-        result = self._executor.execute_select(table.__name__)
-
-        return [table(**item.__dict__) for item in result]
-
+        return result if not first else result[0]
+
+    @_operation
+    def query_all(self, table: type, limit: int = None, offset: int = None,
+                  columns: Iterable[str] = None, defer: Iterable[str] = None):
+        return self._select(table, limit=limit, offset=offset, columns=columns, defer=defer)
+
+    def query_iter(self, table: type, filters: [str, Expr] = None, chunk_size: int = 1000,
+                   columns: Iterable[str] = None, defer: Iterable[str] = None) -> Iterable:
+        columns, factory = self._projection(table, columns, defer, window=chunk_size)
+        condition, params = self._where(filters, table)
+        rows = self._executor.execute_select_iter(table.__name__, columns=columns, condition=condition,
+                                                  params=params, chunk_size=chunk_size, row_factory=factory)
+        instrumentation = self._executor.instrumentation
+        if instrumentation is None:
+            return rows
+        return instrumentation.stream("query_iter", rows)
+
+    @_operation
+    def count(self, table: type, where: [str, Expr] = None) -> int:
+        condition, params = self._where(where, table)
+        rows = self._executor.execute_select(table.__name__, columns=("COUNT(*)",), condition=condition,
+                                             params=params, row_factory=lambda names: tuple)
+        return rows[0][0]
+
+    @_operation
+    def aggregate(self, table: type, aggregates: dict[str, [Aggregate, str]], group_by: Iterable[str] = None,
+                  where: [str, Expr] = None) -> [dict, list]:
+        # computed by the database, only one row per group is transferred; columns may be JSON paths,
+        # a grouped path is named with _ for . (details.tier -> details_tier)
+        # -> {name: value} without group_by, otherwise [DBRow(*group_by, *names)]
+        column = functools.partial(self._executor.column_sql, table.__name__)
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by or ())
+        keys = [column(c) for c in group_by]
+        columns = [key if key == c else f"{key} AS {c.replace('.', '_')}" for c, key in zip(group_by, keys)] + \
+                  [f"{agg if isinstance(agg, str) else agg.sql(column)} AS {name}" for name, agg in aggregates.items()]
+        condition, params = self._where(where, table)
+        rows = self._executor.execute_select(table.__name__, columns=columns, condition=condition, params=params,
+                                             group_by=keys)
+        if group_by:
+            return rows
+        return dict(zip(aggregates, rows[0]))
+
+    @_operation
     def insert_to(self, table: type, data):
         self._executor.execute_insert(table.__name__, tuple(data.__dict__.keys()), tuple(data.__dict__.values()))
-
-    def query_ordered(self, table: type, key: str, reverse: bool = False):
+        self._invalidate(table)
+
+    @_operation
+    def insert_many(self, table: type, rows: Iterable, batch_size: int = 1000) -> int:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        columns = tuple(first.__dict__.keys())
+        values = (tuple(row.__dict__[c] for c in columns) for row in itertools.chain((first,), rows))
+        try:
+            return self._executor.execute_insert_many(table.__name__, columns, values, batch_size)
+        finally:
+            self._invalidate(table)
+
+    @_operation
+    def export(self, table: type, path: str, format: str = None, filters: [str, Expr] = None,
+               chunk_size: int = 1000) -> int:
+        # streamed with fetchmany, only one chunk of rows is held at a time
+        format = transfer.file_format(path, format)
+        names, rows, binary = self._export_rows(table, filters, chunk_size)
+        with transfer.open_file(path, "w") as f:
+            return transfer.write_rows(f, format, names, rows, self._executor._encode_value, binary)
+
+    def _export_rows(self, table: type, filters: [str, Expr] = None, chunk_size: int = 1000) -> tuple:
+        # -> (column names, streamed row tuples, binary columns)
+        condition, params = self._where(filters, table)
+        names = []
+
+        def capture(columns):
+            names.extend(columns)
+            return tuple
+
+        rows = self._executor.execute_select_iter(table.__name__, condition=condition, params=params,
+                                                  chunk_size=chunk_size, row_factory=capture)
+        first = next(rows, None)
+        binary = [column for column, type_, _ in self._executor.describe_table(table.__name__)
+                  if "BLOB" in type_.upper() or "BINARY" in type_.upper()]
+        if first is None:
+            return tuple(self._executor.table_columns(table.__name__)), (), binary
+        return tuple(names), itertools.chain((first,), rows), binary
+
+    @_operation
+    def import_(self, table: type, path: str, format: str = None, batch_size: int = 1000) -> int:
+        # parsed and inserted batch by batch in one transaction, committed once every row is in
+        format = transfer.file_format(path, format)
+        with transfer.open_file(path, "r") as f:
+            columns, rows = transfer.read_rows(f, format)
+            if not columns:
+                return 0
+            try:
+                count = self._executor.execute_insert_many(table.__name__, columns, rows, batch_size)
+            except Exception:
+                self.rollback()
+                raise
+            finally:
+                self._invalidate(table)
+        self.commit()
+        return count
+
+    @_operation
+    def query_ordered(self, table: type, key: str, reverse: bool = False, limit: int = None, offset: int = None,
+                      columns: Iterable[str] = None, defer: Iterable[str] = None):
+        started = time.perf_counter()
+        column = key
         if key:
-            key = f"{SQLCommand.order.value} {key}"
-        result = self._executor.execute_select(table.__name__, sorted_=key)
-        return [table(**item.__dict__) for item in result]
-
+            key = f"{SQLCommand.order.value} {key}{' DESC' if reverse else ''}"
+        result = self._select(table, sorted_=key, limit=limit, offset=offset, columns=columns, defer=defer)
+        if column:
+            self._advise(table, column, started)
+        return result
+
+    @_operation
+    def query_page(self, table: type, order_by: str, after: Any = None, size: int = 50,
+                   reverse: bool = False, ensure_index: bool = False,
+                   columns: Iterable[str] = None, defer: Iterable[str] = None) -> list:
+        # keyset pagination: seeks past the last seen key instead of skipping OFFSET rows,
+        # order_by should be unique (e.g. the primary key) so no rows are skipped between pages
+        if ensure_index and (table.__name__, order_by) not in self._executor._ensured_indexes:
+            # checked once per connection; the primary key is already indexed
+            if order_by != self._executor.primary_key(table.__name__):
+                self.create_index(table, order_by)
+            self._executor._ensured_indexes.add((table.__name__, order_by))
+        condition, params = "", None
+        if after is not None:
+            condition = f"{order_by} {'<' if reverse else '>'} {self._executor.placeholder}"
+            params = (self._executor._encode_value(after),)
+        key = f"{SQLCommand.order.value} {order_by}{' DESC' if reverse else ''}"
+        return self._select(table, condition=condition, params=params, sorted_=key, limit=size,
+                            columns=columns, defer=defer)
+
+    @_operation
     def query_delete_by(self, table: type, filter_by: tuple[str, Any]):
+        started = time.perf_counter()
         self._executor.execute_delete_by(table.__name__, filter_by[0], filter_by[1])
+        self._invalidate(table)
+        self._advise(table, filter_by[0], started, self._executor._encode_value(filter_by[1]))
+
+    @_operation
+    def delete_many(self, table: type, key_column: str, values: Iterable, batch_size: int = 500) -> int:
+        # every batch runs in the current transaction, commit() (or a rollback) covers all of them
+        try:
+            return self._executor.execute_delete_in(table.__name__, key_column, values, batch_size)
+        finally:
+            self._invalidate(table)
+
+    def _advise(self, table: type, column: str, started: float, sample: Any = None):
+        if self._executor.advisor is not None:
+            self._executor.advisor.record(table.__name__, column, time.perf_counter() - started, sample)
+
+    def enable_instrumentation(self, slow_ms: float = 100.0, slow_log_size: int = 100,
+                               explain_slow: bool = True) -> Instrumentation:
+        self._executor.instrumentation = Instrumentation(slow_ms, slow_log_size, explain_slow)
+        return self._executor.instrumentation
+
+    def enable_index_advisor(self, slow_ms: float = 5.0, min_calls: int = 5, auto_create: bool = False) -> IndexAdvisor:
+        self._executor.advisor = IndexAdvisor(self._executor, slow_ms, min_calls, auto_create)
+        return self._executor.advisor
 
+    @staticmethod
+    def _index_name(table: type, columns: tuple) -> str:
+        return f"idx_{table.__name__}_{'_'.join(columns).replace('.', '_')}"
+
+    @_operation
+    def create_index(self, table: type, columns: [Iterable[str], str], unique: bool = False, name: str = None) -> str:
+        columns = (columns,) if isinstance(columns, str) else tuple(columns)
+        name = name or self._index_name(table, columns)
+        self._executor.execute_create_index(table.__name__, columns, name, unique)
+        return name
+
+    def open_blob(self, table: type, column: str, rowid: Any, mode: str = "r"):
+        # -> file-like blob (read/write/seek/tell), rowid is the primary key value on MySQL
+        if mode not in ("r", "w"):
+            raise ValueError(f"unknown blob mode \"{mode}\", expected \"r\" or \"w\"")
+        if mode == "w":
+            self._invalidate(table)
+        return self._executor.open_blob(table.__name__, column, rowid, readonly=mode == "r")
+
+    @_operation
+    def reserve_blob(self, table: type, column: str, rowid: Any, size: int):
+        self._executor.execute_reserve_blob(table.__name__, column, rowid, size)
+        self._invalidate(table)
+
+    @_operation
+    def drop_index(self, table: type, columns: [Iterable[str], str] = None, name: str = None):
+        if not name:
+            name = self._index_name(table, (columns,) if isinstance(columns, str) else tuple(columns))
+        self._executor.execute_drop_index(table.__name__, name)
+        self._executor._ensured_indexes = {key for key in self._executor._ensured_indexes
+                                           if key[0] != table.__name__}
+
+    def register_codec(self, table: Union[str, type], column: str, decode: Callable = decode_json):
+        self._executor.register_codec(table.__name__ if not isinstance(table, str) else table, column, decode)
+
+    @_operation
     def drop_table(self, table: Union[str, type]):
-        self._executor.execute_drop_table(table.__name__ if not isinstance(table, str) else table)
+        name = table.__name__ if not isinstance(table, str) else table
+        self._executor.execute_drop_table(name)
+        self._executor.schemas.forget(name)
+        self._invalidate(name)
 
     def local_databases(self) -> list:
         return [db[0] for db in self._executor.databases()]
 
+    @_operation
     def query_update_table(self, table, data,prime_indexes=0,foreign_key = False):
+        tracker = self._executor.tracker
+        snapshot = tracker.snapshot(data) if tracker is not None else None
+        primary_key = self._executor.primary_key(table.__name__) if snapshot is not None else None
+        if primary_key is not None and primary_key in snapshot:
+            # loaded instance: only the changed columns, matched on the primary key it was loaded with
+            changes = tracker.changes(data)
+            if changes:
+                self._executor.execute_update_table(table.__name__, data, condition=f"{primary_key} = "
+                                                                                   f"{self._executor.placeholder}",
+                                                    filters=changes, params=(snapshot[primary_key],))
+                tracker.track(data)
+                self._invalidate(table)
+            return
         self._executor.execute_update_table(table.__name__, data,prime_indexes=prime_indexes,condition=None,
                                             filters=None,
                                             foreign_key=foreign_key)
+        self._invalidate(table)
+
+    @_operation
+    def upsert_many(self, table: type, rows: Iterable, key: [Iterable[str], str] = None, batch_size: int = 1000) -> int:
+        # insert or overwrite on a conflict with key (the primary key by default)
+        key = key or self._executor.primary_key(table.__name__)
+        if not key:
+            raise ValueError(f"upsert needs a key column on \"{table.__name__}\"")
+        key = (key,) if isinstance(key, str) else tuple(key)
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        columns = tuple(first.__dict__.keys())
+        values = (tuple(row.__dict__[c] for c in columns) for row in itertools.chain((first,), rows))
+        try:
+            return self._executor.execute_insert_many(table.__name__, columns, values, batch_size, key=key)
+        finally:
+            self._invalidate(table)
+
+    def enable_change_tracking(self) -> ChangeTracker:
+        self._executor.tracker = ChangeTracker(self._executor._encode_value)
+        return self._executor.tracker
 
     def query_alter_table_forgkey(self, table, foreign_key, reference: tuple, ondelete="", onupdate=""):
         if ondelete:
@@ -496,6 +1485,7 @@ class SimpleSQL:
         self._executor.execute \
             (f"ALTER TABLE {table} ADD FOREIGN KEY ({foreign_key}) REFERENCES "
              f"{reference[0]}({reference[1]}){ondelete}{onupdate};")
+        self._executor._forget_table(table.__name__ if not isinstance(table, str) else table)
 
     def backup(self, filepath: str, diff: bool = False):
         if self._executor.db.database:
@@ -505,19 +1495,40 @@ class SimpleSQL:
                                    f"consider to connect or created database to backup,"
                                    f" or just use executor.execute_backup()")
 
+    @_operation
     def add(self, instance: Any):
-        temp = instance.__dict__
-        self.create_table(*self._prepare_table(instance))
-        self.insert_to(type(instance), type(instance)(**temp))
+        table = type(instance)
+        # DDL only for tables this connection has not materialized with these columns yet
+        if not self._executor.schemas.known(table.__name__, tuple(instance.__dict__)):
+            self.create_table(*self._prepare_table(instance))
+        self.insert_to(table, instance)
 
+    @_operation
     def delete(self, instance: Any):
-        r = ""
+        condition, params = self._delete_condition(instance)
+        self._executor.execute_delete_if_equal(type(instance).__name__, condition, params)
+        self._invalidate(type(instance))
+
+    def _delete_condition(self, instance: Any) -> tuple[str, tuple]:
+        primary_key = self._executor.primary_key(type(instance).__name__)
+        if primary_key is not None and instance.__dict__.get(primary_key) is not None:
+            return f"{primary_key} = {self._executor.placeholder}", \
+                (self._executor._encode_value(instance.__dict__[primary_key]),)
+        # no usable primary key, the row has to match on every column
+        conditions, params = [], []
         for k, v in instance.__dict__.items():
-            r += f" {k} = \"{v}\" AND"
-        self._executor.execute_delete_if_equal(type(instance).__name__, r[:-3:])
+            if v is None:
+                conditions.append(f"{k} IS NULL")
+            else:
+                conditions.append(f"{k} = {self._executor.placeholder}")
+                params.append(self._executor._encode_value(v))
+        return " AND ".join(conditions), tuple(params)
+
+    def session(self) -> Session:
+        return Session(self)
 
     def _prepare_table(self, instance):
-        table_name = type(instance).__name__
+        table = type(instance)
         temp = {}
         primary = None
 
@@ -538,12 +1549,54 @@ class SimpleSQL:
             else:
                 temp[attribute] = None
 
-        instance.__dict__ = temp
-        return table_name, instance, primary
-
-
-def connect(serverless=False, create_and_ignore=False, *args, **kwargs) -> SQLExecutor:
+        data = object.__new__(table)
+        data.__dict__ = temp
+        return table, data, primary
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_shared_schemas = {}
+
+
+def connect(serverless=False, create_and_ignore=False, *args, pool_size: int = None, max_overflow: int = 10,
+            pool_timeout: float = 30.0, pool_idle_timeout: float = 300.0, shared_schema: bool = False,
+            shards: int = None, shard_key: str = None, threadsafe: bool = False, **kwargs) -> SQLExecutor:
+    if shards:
+        if not serverless or not shard_key:
+            raise ValueError("sharding needs serverless=True and a shard_key")
+        # data.db -> data.0.db ... data.{shards - 1}.db, every file is an independent SQLite database
+        database = kwargs.pop("database", ":memory:")
+        root, ext = os.path.splitext(database)
+        kwargs["check_same_thread"] = False
+        executor = ThreadLocalSQLServerLess if threadsafe else SQLServerLess
+        return ShardedExecutor([executor(*args, database=database if database == ":memory:" else
+                                         f"{root}.{i}{ext}", **kwargs) for i in range(shards)], shard_key)
+    if shared_schema:
+        # one schema registry for every connection of this process to the same database
+        key = (serverless, args, kwargs.get("host"), kwargs.get("port"), kwargs.get("database"))
+        with _pools_lock:
+            schemas = _shared_schemas.setdefault(key, SchemaRegistry())
+        executor = connect(serverless, create_and_ignore, *args, pool_size=pool_size, max_overflow=max_overflow,
+                           pool_timeout=pool_timeout, pool_idle_timeout=pool_idle_timeout, threadsafe=threadsafe,
+                           **kwargs)
+        executor.schemas = schemas
+        return executor
+    if pool_size:
+        if serverless:
+            # a pooled connection may be checked out by a different thread each time
+            kwargs.setdefault("check_same_thread", False)
+        key = (serverless, create_and_ignore, args, threadsafe, repr(sorted(kwargs.items())))
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(lambda: connect(serverless, create_and_ignore, *args,
+                                                                    threadsafe=threadsafe, **kwargs),
+                                                    pool_size, max_overflow, pool_timeout, pool_idle_timeout)
+        return pool.checkout()
     if serverless:
+        if threadsafe:
+            return ThreadLocalSQLServerLess(*args, **kwargs)
         return SQLServerLess(*args, **kwargs)
     if create_and_ignore:
         kwargs["create_and_ignore"] = create_and_ignore
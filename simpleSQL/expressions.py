@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import functools
+from typing import Any, Callable, Iterable
+
+
+class Expr:
+    def __and__(self, other: Expr) -> Expr:
+        return _Junction("AND", self, other)
+
+    def __or__(self, other: Expr) -> Expr:
+        return _Junction("OR", self, other)
+
+    def __invert__(self) -> Expr:
+        return _Not(self)
+
+    def shape(self) -> tuple:
+        ...
+
+    def params(self) -> list:
+        ...
+
+    def compile(self, placeholder: str = "?", column: Callable = None) -> tuple[str, list]:
+        # the SQL text only depends on the shape, so equal shapes share one cached template;
+        # column maps every column name to the SQL it stands for (e.g. a JSON path extraction)
+        shape = self.shape()
+        if column is not None:
+            shape = _resolve(shape, column)
+        return _compile(shape, placeholder), self.params()
+
+
+class _Compare(Expr):
+    def __init__(self, column: str, op: str, value: Any):
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def shape(self) -> tuple:
+        return "cmp", self.column, self.op
+
+    def params(self) -> list:
+        return [self.value]
+
+
+class _In(Expr):
+    def __init__(self, column: str, values: Iterable, negate: bool = False):
+        self.column = column
+        self.values = list(values)
+        self.negate = negate
+
+    def shape(self) -> tuple:
+        return "in", self.column, len(self.values), self.negate
+
+    def params(self) -> list:
+        return self.values
+
+
+class _Between(Expr):
+    def __init__(self, column: str, low: Any, high: Any):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def shape(self) -> tuple:
+        return "between", self.column
+
+    def params(self) -> list:
+        return [self.low, self.high]
+
+
+class _Null(Expr):
+    def __init__(self, column: str, negate: bool = False):
+        self.column = column
+        self.negate = negate
+
+    def shape(self) -> tuple:
+        return "null", self.column, self.negate
+
+    def params(self) -> list:
+        return []
+
+
+class _Like(Expr):
+    def __init__(self, column: str, pattern: str):
+        self.column = column
+        self.pattern = pattern
+
+    def shape(self) -> tuple:
+        return "like", self.column
+
+    def params(self) -> list:
+        return [self.pattern]
+
+
+class _Junction(Expr):
+    def __init__(self, op: str, left: Expr, right: Expr):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def shape(self) -> tuple:
+        return "junction", self.op, self.left.shape(), self.right.shape()
+
+    def params(self) -> list:
+        return self.left.params() + self.right.params()
+
+
+class _Not(Expr):
+    def __init__(self, expr: Expr):
+        self.expr = expr
+
+    def shape(self) -> tuple:
+        return "not", self.expr.shape()
+
+    def params(self) -> list:
+        return self.expr.params()
+
+
+class Aggregate:
+    function = None
+
+    def __init__(self, column: str = "*", distinct: bool = False):
+        self.column = column
+        self.distinct = distinct
+
+    def sql(self, column: Callable = None) -> str:
+        # column maps the column name to the SQL it stands for, like in Expr.compile
+        resolved = column(self.column) if column is not None and self.column != "*" else self.column
+        return f"{self.function}({'DISTINCT ' if self.distinct else ''}{resolved})"
+
+
+class Count(Aggregate):
+    function = "COUNT"
+
+
+class Sum(Aggregate):
+    function = "SUM"
+
+
+class Avg(Aggregate):
+    function = "AVG"
+
+
+class Min(Aggregate):
+    function = "MIN"
+
+
+class Max(Aggregate):
+    function = "MAX"
+
+
+class F:
+    def __init__(self, column: str):
+        self.column = column
+
+    __hash__ = object.__hash__
+
+    def __eq__(self, other) -> Expr:
+        if other is None:
+            return _Null(self.column)
+        return _Compare(self.column, "=", other)
+
+    def __ne__(self, other) -> Expr:
+        if other is None:
+            return _Null(self.column, negate=True)
+        return _Compare(self.column, "<>", other)
+
+    def __lt__(self, other) -> Expr:
+        return _Compare(self.column, "<", other)
+
+    def __le__(self, other) -> Expr:
+        return _Compare(self.column, "<=", other)
+
+    def __gt__(self, other) -> Expr:
+        return _Compare(self.column, ">", other)
+
+    def __ge__(self, other) -> Expr:
+        return _Compare(self.column, ">=", other)
+
+    def in_(self, values: Iterable) -> Expr:
+        return _In(self.column, values)
+
+    def not_in(self, values: Iterable) -> Expr:
+        return _In(self.column, values, negate=True)
+
+    def between(self, low: Any, high: Any) -> Expr:
+        return _Between(self.column, low, high)
+
+    def is_null(self) -> Expr:
+        return _Null(self.column)
+
+    def is_not_null(self) -> Expr:
+        return _Null(self.column, negate=True)
+
+    def like(self, pattern: str) -> Expr:
+        return _Like(self.column, pattern)
+
+    def startswith(self, prefix: str) -> Expr:
+        escaped = prefix.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        return _Like(self.column, escaped + "%")
+
+
+def _resolve(shape: tuple, column: Callable) -> tuple:
+    kind = shape[0]
+    if kind == "junction":
+        return kind, shape[1], _resolve(shape[2], column), _resolve(shape[3], column)
+    if kind == "not":
+        return kind, _resolve(shape[1], column)
+    return (kind, column(shape[1])) + shape[2:]
+
+
+@functools.lru_cache(maxsize=512)
+def _compile(shape: tuple, ph: str) -> str:
+    kind = shape[0]
+    if kind == "cmp":
+        return f"{shape[1]} {shape[2]} {ph}"
+    if kind == "in":
+        _, column, size, negate = shape
+        if not size:
+            # an empty IN matches nothing, an empty NOT IN matches everything
+            return "1 = 1" if negate else "1 = 0"
+        return f"{column} {'NOT IN' if negate else 'IN'} ({','.join([ph] * size)})"
+    if kind == "between":
+        return f"{shape[1]} BETWEEN {ph} AND {ph}"
+    if kind == "null":
+        return f"{shape[1]} IS {'NOT NULL' if shape[2] else 'NULL'}"
+    if kind == "like":
+        return f"{shape[1]} LIKE {ph} ESCAPE '!'"
+    if kind == "junction":
+        return f"({_compile(shape[2], ph)} {shape[1]} {_compile(shape[3], ph)})"
+    if kind == "not":
+        return f"NOT ({_compile(shape[1], ph)})"
+    raise ValueError(f"unknown expression {kind}")
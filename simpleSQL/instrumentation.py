@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import bisect
+import collections
+import contextlib
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Sequence
+
+
+class Histogram:
+    bounds_ms = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.bounds_ms) + 1)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(self.bounds_ms, seconds * 1000)] += 1
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "total_ms": self.total * 1000, "max_ms": self.max * 1000,
+                "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "buckets": dict(zip([f"<={b}ms" for b in self.bounds_ms] + ["inf"], self.buckets))}
+
+
+class StatementEvent:
+    __slots__ = ("statement", "params", "operation", "driver", "materialize", "rows")
+
+    def __init__(self, statement: str, params: Sequence, operation: str):
+        self.statement = statement
+        self.params = params
+        self.operation = operation
+        self.driver = 0.0
+        self.materialize = 0.0
+        self.rows = None
+
+    @property
+    def elapsed(self) -> float:
+        return self.driver + self.materialize
+
+
+class Instrumentation:
+    max_logged_params = 100
+
+    def __init__(self, slow_ms: float = 100.0, slow_log_size: int = 100, explain_slow: bool = True):
+        self.slow_ms = slow_ms
+        self.explain_slow = explain_slow
+        self.slow_queries = collections.deque(maxlen=slow_log_size)
+        self._before = []
+        self._after = []
+        self._operations = {}
+        self._statements = Histogram()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def add_hook(self, before: Callable = None, after: Callable = None):
+        if before:
+            self._before.append(before)
+        if after:
+            self._after.append(after)
+
+    @contextlib.contextmanager
+    def operation(self, name: str):
+        # only the outermost SimpleSQL call is measured, nested ones (add -> insert_to) belong to it
+        if getattr(self._local, "operation", None) is not None:
+            yield
+            return
+        self._local.operation = name
+        stats = self._operation_stats(name)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.operation = None
+            with self._lock:
+                stats["total"].observe(elapsed)
+
+    def stream(self, name: str, rows: Iterator) -> Iterable:
+        # a suspended generator can't stay inside operation(), statements the caller runs between rows would be
+        # accounted to it; each resumption is marked instead, the total is the time spent producing rows
+        stats = self._operation_stats(name)
+        elapsed = 0.0
+        try:
+            while True:
+                outer = getattr(self._local, "operation", None)
+                if outer is None:
+                    self._local.operation = name
+                resumed = time.perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - resumed
+                    if outer is None:
+                        self._local.operation = None
+                yield row
+        except Exception:
+            with self._lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            # also when the caller stops early, the cursor is closed then
+            rows.close()
+            with self._lock:
+                stats["total"].observe(elapsed)
+
+    def _operation_stats(self, name: str) -> dict:
+        with self._lock:
+            stats = self._operations.get(name)
+            if stats is None:
+                stats = self._operations[name] = {"errors": 0, "statements": 0, "rows": 0, "driver": 0.0,
+                                                  "materialize": 0.0, "total": Histogram()}
+            return stats
+
+    def begin(self, statement: str, params: Sequence) -> StatementEvent:
+        event = StatementEvent(statement, params, getattr(self._local, "operation", None))
+        if not getattr(self._local, "explaining", False):
+            for hook in self._before:
+                hook(event)
+        return event
+
+    def end(self, executor, event: StatementEvent):
+        if getattr(self._local, "explaining", False):
+            return
+        with self._lock:
+            self._statements.observe(event.elapsed)
+        if event.operation is not None:
+            stats = self._operation_stats(event.operation)
+            with self._lock:
+                stats["statements"] += 1
+                stats["rows"] += event.rows if event.rows and event.rows > 0 else 0
+                stats["driver"] += event.driver
+                stats["materialize"] += event.materialize
+        if self.slow_ms is not None and event.elapsed * 1000 >= self.slow_ms:
+            self._log_slow(executor, event)
+        for hook in self._after:
+            hook(event)
+
+    def _log_slow(self, executor, event: StatementEvent):
+        plan = None
+        if self.explain_slow and event.statement.lstrip().upper().startswith("SELECT"):
+            # the EXPLAIN itself must not be instrumented (and explained) again, statements of other
+            # threads still are
+            self._local.explaining = True
+            try:
+                plan = executor.explain(event.statement, event.params)
+            except Exception:
+                plan = None
+            finally:
+                self._local.explaining = False
+        params = event.params
+        if params is not None and len(params) > self.max_logged_params:
+            # e.g. a multi-row INSERT binding a whole batch
+            params = tuple(params[:self.max_logged_params])
+        self.slow_queries.append({"statement": event.statement, "params": params,
+                                  "operation": event.operation, "elapsed_ms": event.elapsed * 1000,
+                                  "rows": event.rows, "plan": plan, "at": time.time()})
+
+    def stats(self) -> dict:
+        with self._lock:
+            operations = {name: {"errors": stats["errors"], "statements": stats["statements"], "rows": stats["rows"],
+                                 "driver_ms": stats["driver"] * 1000, "materialize_ms": stats["materialize"] * 1000,
+                                 **stats["total"].snapshot()}
+                          for name, stats in self._operations.items()}
+            return {"statements": self._statements.snapshot(), "operations": operations,
+                    "slow_queries": len(self.slow_queries)}
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import collections
+import threading
+import time
+from typing import Callable
+
+
+class PoolTimeout(Exception):
+    def __init__(self, msg):
+        super().__init__("Timed out waiting for a pooled connection. " + msg)
+
+
+class ConnectionPool:
+    def __init__(self, factory: Callable, pool_size: int = 5, max_overflow: int = 10,
+                 timeout: float = 30.0, idle_timeout: float = 300.0, pre_ping: bool = True):
+        self._factory = factory
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self._idle = collections.deque()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._metrics = {"checkouts": 0, "created": 0, "discarded": 0, "timeouts": 0,
+                         "wait_total": 0.0, "wait_max": 0.0}
+
+    def checkout(self):
+        start = time.monotonic()
+        while True:
+            executor = self._acquire(start)
+            if executor is None:
+                try:
+                    executor = self._factory()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._metrics["created"] += 1
+            elif self.pre_ping and not executor.ping():
+                self._discard(executor)
+                continue
+            break
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._metrics["checkouts"] += 1
+            self._metrics["wait_total"] += waited
+            self._metrics["wait_max"] = max(self._metrics["wait_max"], waited)
+        executor.pool = self
+        return executor
+
+    def _acquire(self, start: float):
+        # returns an idle executor, or None after reserving a slot for a new connection
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    executor, released = self._idle.pop()
+                    if self.idle_timeout and now - released > self.idle_timeout:
+                        self._open -= 1
+                        self._metrics["discarded"] += 1
+                        executor.close()
+                        continue
+                    return executor
+                if self._open < self.pool_size + self.max_overflow:
+                    self._open += 1
+                    return None
+                remaining = self.timeout - (now - start)
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise PoolTimeout(f"pool_size={self.pool_size}, max_overflow={self.max_overflow}")
+                self._cond.wait(remaining)
+
+    def release(self, executor):
+        # caches, tracking and instrumentation enabled by one checkout must not leak into the next
+        executor.reset_state()
+        try:
+            executor.db.rollback()
+        except Exception:
+            self._discard(executor)
+            return
+        with self._cond:
+            if self._open > self.pool_size:
+                self._open -= 1
+                executor.close()
+            else:
+                self._idle.append((executor, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, executor):
+        executor.close()
+        with self._cond:
+            self._open -= 1
+            self._metrics["discarded"] += 1
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                executor, _ = self._idle.pop()
+                self._open -= 1
+                executor.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update(open=self._open, idle=len(self._idle), in_use=self._open - len(self._idle))
+        stats["wait_avg"] = stats["wait_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Any
+
+
+class Session:
+    def __init__(self, db):
+        self._db = db
+        self._inserts = {}
+        self._updates = {}
+        self._deletes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.rollback()
+            return
+        try:
+            self.flush()
+        except Exception:
+            self.rollback()
+            raise
+        self._db.commit()
+
+    def add(self, instance: Any):
+        table = type(instance)
+        # rows of one statement must agree on which columns are left to AUTO_INC
+        shape = tuple((c, v == self._db.AUTO_INC) for c, v in instance.__dict__.items())
+        self._inserts.setdefault((table, shape), []).append(instance)
+
+    def update(self, instance: Any, prime_indexes=0):
+        pairs = [(c, v) for c, v in instance.__dict__.items() if c != prime_indexes]
+        (where, value), pairs = pairs[0], pairs[1:]
+        columns = tuple(c for c, _ in pairs)
+        self._updates.setdefault((type(instance), columns, where), []).append(
+            tuple(v for _, v in pairs) + (value,))
+
+    def delete(self, instance: Any):
+        condition, params = self._db._delete_condition(instance)
+        self._deletes.setdefault((type(instance), condition), []).append(params)
+
+    def rollback(self):
+        self._clear()
+        self._db.rollback()
+
+    def _clear(self):
+        self._inserts.clear()
+        self._updates.clear()
+        self._deletes.clear()
+
+    def _parents(self, table: type) -> list:
+        # the registry only knows tables created by this connection, others are reflected from the database
+        schema = self._db.executor.schemas.get(table.__name__)
+        if schema is not None and schema.reference:
+            return [schema.reference[0]]
+        return self._db.executor.referenced_tables(table.__name__)
+
+    def _dependency_order(self, tables: set) -> list:
+        # referenced (parent) tables before the tables holding the foreign key
+        order, visiting = [], set()
+
+        def visit(table):
+            if table in order or table in visiting:
+                return
+            visiting.add(table)
+            parents = self._parents(table)
+            for parent in tables:
+                if parent.__name__ in parents:
+                    visit(parent)
+            order.append(table)
+
+        for table in sorted(tables, key=lambda t: t.__name__):
+            visit(table)
+        return order
+
+    def flush(self):
+        executor = self._db.executor
+        tables = {key[0] for key in self._inserts} | {key[0] for key in self._updates} | \
+                 {key[0] for key in self._deletes}
+        order = self._dependency_order(tables)
+
+        for table in order:
+            for (table_, _), instances in self._inserts.items():
+                if table_ is not table:
+                    continue
+                if not executor.schemas.known(table.__name__, tuple(instances[0].__dict__)):
+                    self._db.create_table(*self._db._prepare_table(instances[0]))
+                self._db.insert_many(table, instances)
+
+        for table in order:
+            for (table_, columns, where), rows in self._updates.items():
+                if table_ is table:
+                    executor.execute_update_many(table.__name__, columns, where, rows)
+                    self._db._invalidate(table)
+
+        for table in reversed(order):
+            for (table_, condition), rows in self._deletes.items():
+                if table_ is table:
+                    executor.execute_delete_many(table.__name__, condition, rows)
+                    self._db._invalidate(table)
+        self._clear()
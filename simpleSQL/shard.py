@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import operator
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Sequence
+
+from . import transfer
+from .expressions import Aggregate, Avg, Count, Sum
+
+
+class ShardedExecutor:
+    def __init__(self, executors: Sequence, shard_key: str):
+        self.executors = list(executors)
+        self.shard_key = shard_key
+        # sqlite3 releases the GIL while stepping a statement, so scans of different files overlap on threads
+        self._threads = ThreadPoolExecutor(max_workers=len(self.executors), thread_name_prefix="simpleSQL-shard")
+
+    def __enter__(self):
+        return ShardedSQL(self)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            for executor in self.executors:
+                executor.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._threads.shutdown(wait=True)
+
+    def start(self):
+        return self.__enter__()
+
+    def stop(self):
+        self.__exit__(None, None, None)
+
+    def map(self, fn: Callable, items: Iterable) -> list:
+        items = list(items)
+        if len(items) == 1:
+            return [fn(items[0])]
+        return list(self._threads.map(fn, items))
+
+
+class ShardedSQL:
+    # every shard is an independent database: AUTO_INC keys are allocated per shard and collide across shards
+    # (use explicit keys when they must be unique), unique indexes hold per shard, and there is no transaction
+    # spanning the shards, so session() is not supported
+    def __init__(self, executor: ShardedExecutor):
+        self._executor = executor
+        self.shards = [e.__enter__() for e in executor.executors]
+        self.shard_key = executor.shard_key
+        self.AUTO_INC = self.shards[0].AUTO_INC
+
+    @property
+    def executor(self) -> ShardedExecutor:
+        return self._executor
+
+    @property
+    def types(self):
+        return self.shards[0].types
+
+    def shard_index(self, value: Any) -> int:
+        if value == self.AUTO_INC:
+            raise ValueError(f"shard key \"{self.shard_key}\" can't be AUTO_INC, its value picks the shard")
+        # crc32 instead of hash(): str hashes change between processes, rows must not move;
+        # hashed as text so 5 and "5" (as read back from a CSV import) land on the same shard
+        encoded = self.shards[0].executor._encode_value(value)
+        return zlib.crc32(str(encoded).encode()) % len(self.shards)
+
+    def shard_for(self, value: Any):
+        return self.shards[self.shard_index(value)]
+
+    def _all(self, fn: Callable) -> list:
+        return self._executor.map(fn, self.shards)
+
+    def _grouped(self, rows: Iterable, key: Callable = None) -> dict:
+        groups = {}
+        for row in rows:
+            value = key(row) if key else row.__dict__[self.shard_key]
+            groups.setdefault(self.shard_index(value), []).append(row)
+        return groups
+
+    def _scatter(self, rows: Iterable, batch_size: int, insert: Callable, key: Callable = None) -> int:
+        # rows are routed batch_size at a time, so a large input is never held in memory at once
+        rows = iter(rows)
+        count = 0
+        while True:
+            groups = self._grouped(itertools.islice(rows, batch_size), key)
+            if not groups:
+                return count
+            count += sum(self._executor.map(lambda item: insert(self.shards[item[0]], item[1]), groups.items()))
+
+    def commit(self):
+        self._all(lambda db: db.commit())
+
+    def rollback(self):
+        self._all(lambda db: db.rollback())
+
+    def create_table(self, table: type, data, *args, **kwargs):
+        self._all(lambda db: db.create_table(table, data, *args, **kwargs))
+
+    def drop_table(self, table):
+        self._all(lambda db: db.drop_table(table))
+
+    def create_index(self, table: type, columns, unique: bool = False, name: str = None) -> str:
+        # a unique index is only enforced within each shard
+        return self._all(lambda db: db.create_index(table, columns, unique, name))[0]
+
+    def drop_index(self, table: type, columns=None, name: str = None):
+        self._all(lambda db: db.drop_index(table, columns, name))
+
+    def register_codec(self, table, column: str, *args):
+        for db in self.shards:
+            db.register_codec(table, column, *args)
+
+    def insert_to(self, table: type, data):
+        self.shard_for(data.__dict__[self.shard_key]).insert_to(table, data)
+
+    def add(self, instance: Any):
+        self.shard_for(instance.__dict__[self.shard_key]).add(instance)
+
+    def insert_many(self, table: type, rows: Iterable, batch_size: int = 1000) -> int:
+        return self._scatter(rows, batch_size, lambda db, group: db.insert_many(table, group, batch_size))
+
+    def upsert_many(self, table: type, rows: Iterable, key=None, batch_size: int = 1000) -> int:
+        return self._scatter(rows, batch_size, lambda db, group: db.upsert_many(table, group, key, batch_size))
+
+    def query_filter_by(self, table: type, filter_: str, filter_value: Any, first=False, columns=None, defer=None):
+        if filter_ == self.shard_key:
+            return self.shard_for(filter_value).query_filter_by(table, filter_, filter_value, first, columns, defer)
+        results = self._all(lambda db: db.query_filter_by(table, filter_, filter_value, first, columns, defer))
+        results = [r for r in results if r is not None]
+        if first:
+            return results[0] if results else None
+        return list(itertools.chain.from_iterable(results)) or None
+
+    @staticmethod
+    def _window(rows: Iterable, limit: int = None, offset: int = None) -> list:
+        offset = offset or 0
+        return list(itertools.islice(rows, offset, offset + limit if limit is not None else None))
+
+    @staticmethod
+    def _shard_limit(limit: int = None, offset: int = None) -> [int, None]:
+        # every shard may hold all of the first limit + offset rows
+        return limit + (offset or 0) if limit is not None else None
+
+    def query_filters(self, table: type, filters, first: bool = False, limit: int = None, offset: int = None,
+                      columns=None, defer=None):
+        shard_limit = self._shard_limit(1 if first else limit, offset)
+        results = self._all(lambda db: db.query_filters(table, filters, limit=shard_limit, columns=columns,
+                                                        defer=defer) or [])
+        result = self._window(itertools.chain.from_iterable(results), 1 if first else limit, offset)
+        if not result:
+            return None
+        return result if not first else result[0]
+
+    def query_all(self, table: type, limit: int = None, offset: int = None, columns=None, defer=None) -> list:
+        shard_limit = self._shard_limit(limit, offset)
+        results = self._all(lambda db: db.query_all(table, limit=shard_limit, columns=columns, defer=defer))
+        return self._window(itertools.chain.from_iterable(results), limit, offset)
+
+    def query_ordered(self, table: type, key: str, reverse: bool = False, limit: int = None, offset: int = None,
+                      columns=None, defer=None) -> list:
+        shard_limit = self._shard_limit(limit, offset)
+        results = self._all(lambda db: db.query_ordered(table, key, reverse, limit=shard_limit, columns=columns,
+                                                        defer=defer))
+        if not key:
+            return self._window(itertools.chain.from_iterable(results), limit, offset)
+        # k-way merge of the already sorted shard results, NULL sorts first like in SQLite
+        get = operator.attrgetter(key)
+        merged = heapq.merge(*results, key=lambda row: (get(row) is not None, get(row)), reverse=reverse)
+        return self._window(merged, limit, offset)
+
+    def query_page(self, table: type, order_by: str, after: Any = None, size: int = 50, reverse: bool = False,
+                   ensure_index: bool = False, columns=None, defer=None) -> list:
+        # the next page is among the next size rows of every shard
+        results = self._all(lambda db: db.query_page(table, order_by, after, size, reverse, ensure_index,
+                                                     columns, defer))
+        get = operator.attrgetter(order_by)
+        merged = heapq.merge(*results, key=lambda row: (get(row) is not None, get(row)), reverse=reverse)
+        return self._window(merged, size)
+
+    def export(self, table: type, path: str, format: str = None, filters=None, chunk_size: int = 1000) -> int:
+        # one file holding the rows of every shard, shard after shard
+        format = transfer.file_format(path, format)
+        sources = [db._export_rows(table, filters, chunk_size) for db in self.shards]
+        names, _, binary = sources[0]
+        with transfer.open_file(path, "w") as f:
+            return transfer.write_rows(f, format, names, itertools.chain.from_iterable(s[1] for s in sources),
+                                       self.shards[0].executor._encode_value, binary)
+
+    def import_(self, table: type, path: str, format: str = None, batch_size: int = 1000) -> int:
+        # rows are routed by their shard key, then committed on every shard once all are in
+        format = transfer.file_format(path, format)
+        with transfer.open_file(path, "r") as f:
+            columns, rows = transfer.read_rows(f, format)
+            if not columns:
+                return 0
+            key = columns.index(self.shard_key)
+            try:
+                count = self._scatter(rows, batch_size, lambda db, group: db.executor.execute_insert_many(
+                    table.__name__, columns, group, batch_size), key=lambda row: row[key])
+            except Exception:
+                self._all(lambda db: db.rollback())
+                raise
+            finally:
+                for db in self.shards:
+                    db._invalidate(table)
+        self.commit()
+        return count
+
+    def session(self):
+        raise NotImplementedError("sessions are not supported on sharded connections, "
+                                  "the shards have no shared transaction")
+
+    def count(self, table: type, where=None) -> int:
+        return sum(self._all(lambda db: db.count(table, where)))
+
+    def aggregate(self, table: type, aggregates: dict, group_by=None, where=None) -> [dict, list]:
+        # every shard aggregates its rows, the partial results are merged per group:
+        # SUM and COUNT add up, MIN/MAX of the shard values, AVG from the merged SUM and COUNT
+        partials = {}
+        for name, agg in aggregates.items():
+            mergeable = isinstance(agg, Avg) or (isinstance(agg, Aggregate) and agg.function in self._merges)
+            if not mergeable or (agg.distinct and agg.function not in ("MIN", "MAX")):
+                raise ValueError(f"aggregate \"{name}\" can't be merged across shards, "
+                                 f"use Count, Sum, Min, Max or Avg without distinct")
+            if isinstance(agg, Avg):
+                partials[f"{name}__sum"], partials[f"{name}__count"] = Sum(agg.column), Count(agg.column)
+            else:
+                partials[name] = agg
+        merges = [self._merges[agg.function] for agg in partials.values()]
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by or ())
+        results = self._all(lambda db: db.aggregate(table, partials, group_by, where))
+
+        groups, names = {}, None
+        for result in results:
+            if not group_by:
+                result = [tuple(result.values())]
+            elif result:
+                names = result[0]._fields[:len(group_by)]
+            for row in result:
+                key, values = tuple(row[:len(group_by)]), tuple(row[len(group_by):])
+                merged = groups.get(key)
+                groups[key] = values if merged is None else tuple(map(self._merge, merges, merged, values))
+
+        rows = []
+        for key in sorted(groups, key=lambda k: tuple((v is not None, v) for v in k)):
+            values = dict(zip(partials, groups[key]))
+            for name, agg in aggregates.items():
+                if isinstance(agg, Avg):
+                    total, count = values.pop(f"{name}__sum"), values.pop(f"{name}__count")
+                    values[name] = total / count if count else None
+            rows.append((key, tuple(values[name] for name in aggregates)))
+        if not group_by:
+            return dict(zip(aggregates, rows[0][1]))
+        if not rows:
+            return []
+        row_type = namedtuple("DBRow", tuple(names) + tuple(aggregates), rename=True)
+        return [row_type(*key, *values) for key, values in rows]
+
+    _merges = {"SUM": operator.add, "COUNT": operator.add, "MIN": min, "MAX": max}
+
+    @staticmethod
+    def _merge(merge: Callable, a, b):
+        # NULL (a shard without matching rows) doesn't take part
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return merge(a, b)
+
+    def query_iter(self, table: type, filters=None, chunk_size: int = 1000, columns=None, defer=None) -> Iterable:
+        for db in self.shards:
+            yield from db.query_iter(table, filters, chunk_size, columns, defer)
+
+    def query_delete_by(self, table: type, filter_by: tuple[str, Any]):
+        if filter_by[0] == self.shard_key:
+            return self.shard_for(filter_by[1]).query_delete_by(table, filter_by)
+        self._all(lambda db: db.query_delete_by(table, filter_by))
+
+    def delete_many(self, table: type, key_column: str, values: Iterable, batch_size: int = 500) -> int:
+        if key_column != self.shard_key:
+            values = list(values)
+            return sum(self._all(lambda db: db.delete_many(table, key_column, values, batch_size)))
+        return self._scatter(values, batch_size, lambda db, group: db.delete_many(table, key_column, group,
+                                                                                   batch_size), key=lambda v: v)
+
+    def query_update_table(self, table, data, prime_indexes=0, foreign_key=False):
+        self.shard_for(data.__dict__[self.shard_key]).query_update_table(table, data, prime_indexes, foreign_key)
+
+    def delete(self, instance: Any):
+        self.shard_for(instance.__dict__[self.shard_key]).delete(instance)
@@ -1,6 +1,11 @@
+import asyncio
+import gc
 import os
+import threading
 import unittest
+import weakref
 import simpleSQL
+from simpleSQL import F, Count, Sum, Avg, Min, Max
 
 
 class SampleTable:
@@ -9,6 +14,28 @@ class SampleTable:
         self.name = name
 
 
+class Purchase:
+    def __init__(self, id, name, details):
+        self.id = id
+        self.name = name
+        self.details = details
+
+
+class TaggedPurchase:
+    def __init__(self, id, name, details, tags):
+        self.id = id
+        self.name = name
+        self.details = details
+        self.tags = tags
+
+
+class Sale:
+    def __init__(self, id, name, price):
+        self.id = id
+        self.name = name
+        self.price = price
+
+
 class TestSimpleSQL(unittest.TestCase):
 
     def tearDown(self) -> None:
@@ -35,3 +62,588 @@ class TestSimpleSQL(unittest.TestCase):
             db.insert_to(SampleTable, obj)
             obj1 = db.query_filter_by(SampleTable, "id", 1, first=True)
             assert 1 == obj1.id and obj.name == obj1.name
+
+    def test_insert_many(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.objType())
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            rows = (SampleTable(db.AUTO_INC, [i, "x"]) for i in range(2500))
+            assert 2500 == db.insert_many(SampleTable, rows, batch_size=1000)
+            db.commit()
+            res = db.query_all(SampleTable)
+            assert 2500 == len(res) and [7, "x"] == res[7].name and 8 == res[7].id
+            # an explicit key among AUTO_INC rows goes in its own statement
+            mixed = [SampleTable(5000, ["a"]), SampleTable(db.AUTO_INC, ["b"]), SampleTable(db.AUTO_INC, ["c"])]
+            assert 3 == db.insert_many(SampleTable, mixed)
+            assert [5000, 5001, 5002] == [r.id for r in db.query_filters(SampleTable, F("id") >= 5000)]
+
+    def test_statement_cache(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.varchar(50))
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            for name in ("a", "b", "c\" OR 1=1 --"):
+                db.insert_to(SampleTable, SampleTable(db.AUTO_INC, name))
+            for name in ("a", "b", "c\" OR 1=1 --"):
+                assert name == db.query_filter_by(SampleTable, "name", name, first=True).name
+            db.query_delete_by(SampleTable, ("name", "c\" OR 1=1 --"))
+            assert 2 == len(db.query_all(SampleTable))
+            stats = db.executor.statement_cache.stats()
+            assert 4 == stats["hits"] and 4 == stats["misses"]
+
+    def test_query_iter(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.varchar(50))
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, f"n{i}") for i in range(25)))
+            it = db.query_iter(SampleTable, "id > 5", chunk_size=4)
+            assert 6 == next(it).id
+            # the shared cursor can be used while the iterator is still open
+            assert "n0" == db.query_filter_by(SampleTable, "id", 1, first=True).name
+            assert list(range(7, 26)) == [row.id for row in it]
+
+    def test_column_codecs(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.varchar(50))
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            # a plain text column is never decoded, even if the value looks like an encoded list
+            db.insert_to(SampleTable, SampleTable(db.AUTO_INC, '{"list": [1]}'))
+            assert '{"list": [1]}' == db.query_all(SampleTable)[0].name
+            db.register_codec(SampleTable, "name")
+            assert [1] == db.query_all(SampleTable)[0].name
+
+    def test_object_column_plain_values(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(SampleTable, SampleTable(db.types.integer(), db.types.objType()), primary_key="id")
+            for i, name in enumerate(["hello", "123", "{not json", [1, "2"], {"a": 1}]):
+                db.insert_to(SampleTable, SampleTable(i, name))
+            # only the list/dict envelope is decoded, other values come back as they were stored
+            assert ["hello", "123", "{not json", [1, "2"], {"a": 1}] == \
+                   [r.name for r in db.query_ordered(SampleTable, "id")]
+
+    def test_object_column_declared_types(self):
+        assert "LONGTEXT" == simpleSQL.executor.SQLTypes.objType()
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            # tables declared with a JSON type, and ones created before with LONGTEXT, are decoded alike
+            for type_ in ("LONGTEXT", "TEXT(100)", "JSON_TEXT"):
+                db.create_table(SampleTable, SampleTable(db.types.integer(), type_), primary_key="id")
+                db.executor.execute("INSERT INTO SampleTable VALUES (1, ?);", ('{"list": [1, 2]}',))
+                assert [1, 2] == db.query_all(SampleTable)[0].name
+                db.drop_table(SampleTable)
+
+    def test_connection_pool(self):
+        with simpleSQL.connect(serverless=True, database="pool.db", pool_size=1, max_overflow=1) as db:
+            first = db.executor
+            db.create_table(SampleTable, SampleTable(db.types.column(db.types.integer()),
+                                                     db.types.column(db.types.varchar(50))))
+            db.insert_to(SampleTable, SampleTable(1, "uncommitted"))
+        with simpleSQL.connect(serverless=True, database="pool.db", pool_size=1, max_overflow=1) as db:
+            assert first is db.executor
+            # released connections are rolled back before reuse
+            assert [] == db.query_all(SampleTable)
+            with simpleSQL.connect(serverless=True, database="pool.db", pool_size=1, max_overflow=1) as other:
+                assert other.executor is not first
+            pool = first.pool
+            stats = pool.stats()
+            assert 3 == stats["checkouts"] and 2 == stats["created"] and 1 == stats["open"]
+            db.enable_result_cache()
+            db.enable_change_tracking()
+        with simpleSQL.connect(serverless=True, database="pool.db", pool_size=1, max_overflow=1) as db:
+            # a later checkout of the same connection starts without them
+            assert first is db.executor and db.executor.result_cache is None and db.executor.tracker is None
+        pool.close()
+
+    def test_sqlite_profile(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db", profile="fast") as db:
+            db.executor.execute("PRAGMA journal_mode;")
+            assert "wal" == db.executor._cursor.fetchone()[0]
+            db.executor.execute("PRAGMA foreign_keys;")
+            assert 1 == db.executor._cursor.fetchone()[0]
+        with simpleSQL.connect(serverless=True, database="mydb.db", profile={"synchronous": "OFF"}) as db:
+            db.executor.execute("PRAGMA synchronous;")
+            assert 0 == db.executor._cursor.fetchone()[0]
+        with self.assertRaises(ValueError):
+            simpleSQL.connect(serverless=True, database="mydb.db", profile="unknown")
+
+    def test_async_connect(self):
+        async def run():
+            async with simpleSQL.connect_async(serverless=True, database="mydb.db") as db:
+                data = SampleTable(
+                    db.types.column(db.types.integer(), auto_increment=True)
+                    , db.types.column(db.types.varchar(50))
+                )
+                await db.create_table(SampleTable, data, primary_key="id")
+                await asyncio.gather(*(db.insert_to(SampleTable, SampleTable(db.AUTO_INC, f"n{i}"))
+                                       for i in range(10)))
+                await db.commit()
+                assert 10 == len(await db.query_all(SampleTable))
+                async for row in db.query_iter(SampleTable, chunk_size=3, columns=["id"]):
+                    assert {"id": 1} == row.__dict__
+                    break
+                async with db.session() as session:
+                    session.add(SampleTable(db.AUTO_INC, "s"))
+                    session.delete(SampleTable(1, "n0"))
+                self.assertRaises(AttributeError, getattr, db, "open_blob")
+                return [row.id async for row in db.query_iter(SampleTable, "id > 4", chunk_size=3)]
+
+        with self.assertNoLogs(level="ERROR"):
+            assert list(range(5, 12)) == asyncio.run(run())
+
+    def test_add_schema_cache(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            obj = SampleTable(db.AUTO_INC, "tal")
+            db.add(obj)
+            assert "tal" == obj.name
+            created = []
+            db.executor.execute_create_table = lambda *args, **kwargs: created.append(args)
+            db.add(SampleTable(db.AUTO_INC, "dan"))
+            db.add(SampleTable(db.AUTO_INC, "ron"))
+            assert [] == created
+            assert ["tal", "dan", "ron"] == [row.name for row in db.query_all(SampleTable)]
+        with simpleSQL.connect(serverless=True, database="mydb.db", shared_schema=True) as db:
+            db.add(SampleTable(db.AUTO_INC, "gal"))
+        with simpleSQL.connect(serverless=True, database="mydb.db", shared_schema=True) as db:
+            assert db.executor.schemas.known("SampleTable", ("id", "name"))
+
+    def test_add_tuple_attribute(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.add(SampleTable(db.AUTO_INC, (1, "x")))
+            assert [1, "x"] == db.query_filter_by(SampleTable, "id", 1, first=True).name
+
+    def test_index_advisor(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.varchar(50))
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, f"n{i}") for i in range(100)))
+            advisor = db.enable_index_advisor(slow_ms=0, min_calls=3)
+            for i in range(3):
+                db.query_filter_by(SampleTable, "name", f"n{i}")
+                db.query_filter_by(SampleTable, "id", i + 1)
+            assert ["idx_SampleTable_name"] == [s["index"] for s in advisor.report()]
+            assert ["idx_SampleTable_name"] == advisor.apply()
+            assert [] == advisor.report()
+            db.drop_index(SampleTable, "name")
+            assert 1 == len(advisor.report())
+            db.create_index(SampleTable, ["name"], unique=True)
+            assert [] == advisor.report()
+
+    def test_result_cache(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.objType())
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            db.insert_to(SampleTable, SampleTable(db.AUTO_INC, ["a"]))
+            db.commit()
+            cache = db.enable_result_cache(max_entries=2)
+            db.query_all(SampleTable)[0].name.append("mutated")
+            assert [["a"]] == [row.name for row in db.query_all(SampleTable)]
+            db.query_filter_by(SampleTable, "id", 1)
+            db.query_filters(SampleTable, "id  >  0")
+            db.query_filters(SampleTable, "id > 0")
+            stats = cache.stats()
+            assert 2 == stats["hits"] and 3 == stats["misses"] and 1 == stats["evictions"]
+            db.insert_to(SampleTable, SampleTable(db.AUTO_INC, ["b"]))
+            assert 0 == cache.stats()["entries"]
+            assert 2 == len(db.query_filters(SampleTable, "id > 0"))
+            db.rollback()
+            # the rows cached inside the rolled back transaction are gone with it
+            assert 0 == cache.stats()["entries"] and 1 == len(db.query_filters(SampleTable, "id > 0"))
+
+    def test_session(self):
+        class Parent:
+            def __init__(self, id, name):
+                self.id = id
+                self.name = name
+
+        class Child:
+            def __init__(self, id, parent_id):
+                self.id = id
+                self.parent_id = parent_id
+
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(Parent, Parent(db.types.integer(), db.types.varchar(50)), primary_key="id")
+            db.create_table(Child, Child(db.types.integer(), db.types.integer()), primary_key="id",
+                            foreign_key="parent_id", reference=("Parent", "id"))
+            with db.session() as session:
+                # children are queued first, the flush still inserts parents before them
+                for i in range(50):
+                    session.add(Child(i, i % 5))
+                for i in range(5):
+                    session.add(Parent(i, f"p{i}"))
+            assert 50 == len(db.query_all(Child))
+            with db.session() as session:
+                session.update(Parent(0, "renamed"))
+                for child in db.query_filter_by(Child, "parent_id", 4):
+                    session.delete(child)
+                session.delete(Parent(4, "p4"))
+            assert "renamed" == db.query_filter_by(Parent, "id", 0, first=True).name
+            assert 40 == len(db.query_all(Child)) and 4 == len(db.query_all(Parent))
+            with self.assertRaises(RuntimeError):
+                with db.session() as session:
+                    session.add(Parent(9, "p9"))
+                    session.flush()
+                    raise RuntimeError()
+            assert db.query_filter_by(Parent, "id", 9) is None
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            # a new connection doesn't know the tables, the foreign key is read from the database
+            with db.session() as session:
+                session.add(Child(50, 7))
+                session.add(Parent(7, "p7"))
+            assert 7 == db.query_filter_by(Child, "id", 50, first=True).parent_id
+
+    def test_pagination(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.varchar(50))
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, f"n{i % 7}") for i in range(30)))
+            assert [30, 29] == [row.id for row in db.query_ordered(SampleTable, "id", reverse=True, limit=2)]
+            assert [11, 12, 13] == [row.id for row in db.query_all(SampleTable, limit=3, offset=10)]
+            assert [29, 30] == [row.id for row in db.query_all(SampleTable, offset=28)]
+            assert [5, 6] == [row.id for row in db.query_filters(SampleTable, "id > 4", limit=2)]
+            seen, after = [], None
+            while True:
+                page = db.query_page(SampleTable, "id", after=after, size=8, ensure_index=True)
+                if not page:
+                    break
+                seen.extend(row.id for row in page)
+                after = page[-1].id
+            assert list(range(1, 31)) == seen
+            created = []
+            create_index = db.executor.execute_create_index
+            db.executor.execute_create_index = lambda *args: created.append(args) or create_index(*args)
+            db.query_page(SampleTable, "name", size=5, ensure_index=True)
+            db.query_page(SampleTable, "name", after="n1", size=5, ensure_index=True)
+            # created once, and never for the primary key, which already is the rowid
+            assert [("SampleTable", ("name",), "idx_SampleTable_name", False)] == created
+            assert ["idx_SampleTable_name"] == [row[0] for row in db.executor.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'SampleTable'")]
+            assert [3, 2, 1] == [row.id for row in db.query_page(SampleTable, "id", after=4, reverse=True)]
+
+    def test_projection_and_deferred_columns(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(Purchase, Purchase(db.types.integer(), db.types.varchar(50), db.types.objType()),
+                            primary_key="id")
+            db.insert_many(Purchase, (Purchase(i, f"o{i}", {"price": i}) for i in range(1, 11)))
+            orders = db.query_all(Purchase, columns=["id", "name"])
+            assert {"id": 1, "name": "o1"} == orders[0].__dict__
+            orders = db.query_filters(Purchase, "id > 5", defer=["details"])
+            assert all("details" not in order.__dict__ for order in orders)
+            queries = db.executor.statement_cache.misses
+            assert {"price": 7} == orders[1].details and isinstance(orders[1], Purchase)
+            # one batched query filled the deferred column of the whole result set
+            assert db.executor.statement_cache.misses == queries + 1
+            assert [6, 8, 9, 10] == [order.details["price"] for order in orders if order.id != 7]
+
+            db.insert_many(Purchase, (Purchase(i, f"o{i}", {"price": i}) for i in range(11, 1001)))
+            alive = weakref.WeakSet()
+            streamed = db.query_iter(Purchase, defer=["details"], chunk_size=100)
+            first = next(streamed)
+            for order in streamed:
+                alive.add(order)
+            # only the latest chunk is held for batched loading, not the whole stream
+            gc.collect()
+            assert len(alive) <= 100
+            assert {"price": 1} == first.details
+
+    def test_filter_expressions(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(
+                db.types.column(db.types.integer(), auto_increment=True)
+                , db.types.column(db.types.varchar(50))
+            )
+            db.create_table(SampleTable, data, primary_key="id")
+            names = ["a_1", "ab1", "b%", None, "c"]
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, name) for name in names))
+
+            def ids(expr):
+                return [row.id for row in db.query_filters(SampleTable, expr) or []]
+
+            assert [1, 3] == ids((F("id") > 0) & F("name").in_(["a_1", "b%"]))
+            assert [1] == ids(F("name").startswith("a_"))
+            assert [3] == ids(F("name").startswith("b%"))
+            assert [4] == ids(F("name") == None)
+            assert [2, 3, 4] == ids(F("id").between(2, 4))
+            assert [1, 5] == ids(~F("id").between(2, 4) & F("name").is_not_null())
+            assert [] == ids(F("name").in_([]))
+            misses = db.executor.statement_cache.misses
+            assert [2, 5] == ids(F("name").in_(["ab1", "c"]) | (F("id") < 0))
+            assert [1, 2] == ids(F("name").in_(["a_1", "ab1"]) | (F("id") < -1))
+            assert misses + 1 == db.executor.statement_cache.misses
+            assert [5] == [row.id for row in db.query_iter(SampleTable, F("name") >= "c")]
+
+    def test_instrumentation(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            instrumentation = db.enable_instrumentation(slow_ms=0)
+            events = []
+            instrumentation.add_hook(after=events.append)
+            db.add(SampleTable(db.AUTO_INC, "tal"))
+            db.insert_many(SampleTable, [SampleTable(db.AUTO_INC, "dan"), SampleTable(db.AUTO_INC, "ron")])
+            assert 3 == len(db.query_all(SampleTable))
+            assert 2 == sum(1 for _ in db.query_iter(SampleTable, "id > 1"))
+            assert 3 == events[-2].rows and events[-2].operation == "query_all"
+            assert 2 == events[-1].rows and events[-1].statement.startswith("SELECT")
+            assert "query_iter" == events[-1].operation
+            stats = instrumentation.stats()
+            assert {"add", "insert_many", "query_all", "query_iter"} == set(stats["operations"])
+            query_iter = stats["operations"]["query_iter"]
+            assert 1 == query_iter["count"] and 1 == query_iter["statements"] and 2 == query_iter["rows"]
+            # the nested create_table/insert_to calls are accounted to add
+            assert 1 == stats["operations"]["add"]["count"] and 2 == stats["operations"]["add"]["statements"]
+            query_all = stats["operations"]["query_all"]
+            assert 1 == query_all["count"] and 3 == query_all["rows"] and query_all["materialize_ms"] > 0
+            slow = instrumentation.slow_queries[-1]
+            assert slow["plan"] and slow["rows"] == 2
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, f"n{i}") for i in range(500)))
+            # a batch is logged by its first row only
+            assert [("n0",)] == instrumentation.slow_queries[-1]["params"]
+
+    def test_change_tracking_and_upsert(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(Purchase, Purchase(db.types.integer(), db.types.varchar(50), db.types.objType()),
+                            primary_key="id")
+            db.insert_many(Purchase, (Purchase(i, f"o{i}", {"price": i}) for i in range(1, 4)))
+            db.enable_change_tracking()
+            statements = []
+            db.enable_instrumentation(slow_ms=None).add_hook(after=lambda e: statements.append(e.statement))
+            order = db.query_filter_by(Purchase, "id", 2, first=True)
+            db.query_update_table(Purchase, order)
+            order.details["price"] = 20
+            db.query_update_table(Purchase, order)
+            # nothing changed -> no statement, then only the mutated JSON column keyed by the primary key
+            assert "UPDATE Purchase SET details = ? WHERE id = ?;" == statements[-1] and 2 == len(statements)
+            assert {"price": 20} == db.query_filter_by(Purchase, "id", 2, first=True).details
+
+            assert 2 == db.upsert_many(Purchase, [Purchase(3, "renamed", {"price": 3}), Purchase(4, "o4", None)])
+            assert ["o1", "o2", "renamed", "o4"] == [o.name for o in db.query_ordered(Purchase, "id")]
+
+    def test_delete_by_primary_key_and_delete_many(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            data = SampleTable(db.types.column(db.types.integer(), auto_increment=True),
+                               db.types.column(db.types.varchar(50)))
+            db.create_table(SampleTable, data, primary_key="id")
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, f"n{i}") for i in range(1200)))
+            statements = []
+            db.enable_instrumentation(slow_ms=None).add_hook(after=lambda e: statements.append(e.statement))
+            # the stale name doesn't matter, the row is found by its primary key
+            db.delete(SampleTable(1, "changed"))
+            assert "DELETE FROM SampleTable WHERE id = ?;" == statements[-1]
+            assert 1000 == db.delete_many(SampleTable, "id", range(1, 1002), batch_size=400)
+            assert 4 == len(statements)
+            db.commit()
+            assert 199 == len(db.query_all(SampleTable))
+
+    def test_export_import(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(Purchase, Purchase(db.types.integer(), db.types.varchar(50), db.types.objType()),
+                            primary_key="id")
+            # empty strings and NULLs must stay apart in both formats
+            db.insert_many(Purchase, (Purchase(i, f"o{i}" if i % 5 else "", {"tags": ["a", i]} if i % 2 else None)
+                                      for i in range(1, 2501)))
+            expected = [o.__dict__ for o in db.query_ordered(Purchase, "id")]
+            try:
+                for path in ("purchases.jsonl", "purchases.csv"):
+                    assert 2500 == db.export(Purchase, path, chunk_size=300)
+                    db.delete_many(Purchase, "id", range(1, 2501))
+                    assert 2500 == db.import_(Purchase, path, batch_size=700)
+                    assert expected == [o.__dict__ for o in db.query_ordered(Purchase, "id")]
+                assert 1 == db.export(Purchase, "purchases.csv", filters=F("id") == 3)
+
+                db.create_table(SampleTable, SampleTable(db.types.integer(), db.types.blob()), primary_key="id")
+                blobs = [SampleTable(1, bytes(range(256))), SampleTable(2, b"\x00\x01abc"), SampleTable(3, None)]
+                db.insert_many(SampleTable, blobs)
+                for path in ("purchases.jsonl", "purchases.csv"):
+                    assert 3 == db.export(SampleTable, path)
+                    db.delete_many(SampleTable, "id", [1, 2, 3])
+                    assert 3 == db.import_(SampleTable, path)
+                    # binary values round trip as bytes, not as their repr
+                    assert [b.__dict__ for b in blobs] == [r.__dict__ for r in db.query_ordered(SampleTable, "id")]
+            finally:
+                for path in ("purchases.jsonl", "purchases.csv"):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def test_shards(self):
+        with simpleSQL.connect(serverless=True, database="sharded.db", shards=3, shard_key="name") as db:
+            data = SampleTable(db.types.column(db.types.integer()), db.types.column(db.types.varchar(50)))
+            db.create_table(SampleTable, data, primary_key="id")
+            assert 300 == db.insert_many(SampleTable, (SampleTable(i, f"n{i}") for i in range(300)), batch_size=70)
+            db.add(SampleTable(300, "n300"))
+            db.commit()
+            # every shard got a part of the rows
+            assert all(0 < len(shard.query_all(SampleTable)) < 301 for shard in db.shards)
+            assert 77 == db.query_filter_by(SampleTable, "name", "n77", first=True).id
+            assert "n150" == db.query_filter_by(SampleTable, "id", 150, first=True).name
+            assert list(range(300, 290, -1)) == [r.id for r in db.query_ordered(SampleTable, "id", reverse=True,
+                                                                               limit=10)]
+            assert [5, 6, 7] == [r.id for r in db.query_ordered(SampleTable, "id", limit=3, offset=5)]
+            assert 10 == len(db.query_filters(SampleTable, F("id") < 10))
+            db.query_delete_by(SampleTable, ("name", "n0"))
+            assert 99 == db.delete_many(SampleTable, "name", [f"n{i}" for i in range(1, 100)])
+            assert 201 == len(db.query_all(SampleTable))
+            # shard results are merged, AVG from the sums and counts of every shard
+            assert {"n": 201, "total": 40200, "avg": 200.0, "low": 100, "high": 300} == \
+                   db.aggregate(SampleTable, {"n": Count(), "total": Sum("id"), "avg": Avg("id"), "low": Min("id"),
+                                              "high": Max("id")})
+            self.assertRaises(ValueError, db.aggregate, SampleTable, {"n": "COUNT(*)"})
+        assert {f"sharded.{i}.db" for i in range(3)} <= set(os.listdir())
+
+        with simpleSQL.connect(serverless=True, database="byid.db", shards=3, shard_key="id") as db:
+            db.create_table(SampleTable, SampleTable(db.types.integer(), db.types.varchar(50)), primary_key="id")
+            db.insert_many(SampleTable, (SampleTable(i, f"n{i}") for i in range(100, 301)))
+            seen, after = [], None
+            while True:
+                page = db.query_page(SampleTable, "id", after=after, size=40)
+                if not page:
+                    break
+                seen.extend(row.id for row in page)
+                after = page[-1].id
+            assert list(range(100, 301)) == seen
+            try:
+                assert 201 == db.export(SampleTable, "sharded.csv")
+                db.delete_many(SampleTable, "id", range(301))
+                assert 0 == db.count(SampleTable)
+                assert 201 == db.import_(SampleTable, "sharded.csv")
+                # CSV values come back as text, they still route to the shard holding the key
+                assert "n150" == db.query_filter_by(SampleTable, "id", 150, first=True).name
+                assert 201 == db.count(SampleTable)
+            finally:
+                os.remove("sharded.csv")
+            self.assertRaises(NotImplementedError, db.session)
+            db.insert_many(SampleTable, (SampleTable(i, "dup") for i in range(400, 410)))
+            assert all(shard.count(SampleTable, F("name") == "dup") for shard in db.shards)
+            # one group spread over every shard
+            assert [("dup", 10, 404.5)] == db.aggregate(SampleTable, {"n": Count(), "avg": Avg("id")},
+                                                        group_by="name", where=F("name") == "dup")
+
+    def test_threadsafe_connections(self):
+        executor = simpleSQL.connect(serverless=True, database="mydb.db", threadsafe=True)
+        with executor as db:
+            data = SampleTable(db.types.column(db.types.integer(), auto_increment=True),
+                               db.types.column(db.types.varchar(50)))
+            db.create_table(SampleTable, data, primary_key="id")
+            db.insert_many(SampleTable, (SampleTable(db.AUTO_INC, f"n{i}") for i in range(100)))
+            db.commit()
+            errors, counts = [], []
+            # every worker is alive while the others open their connection, none is pruned as finished
+            started = threading.Barrier(4)
+
+            def worker(i):
+                try:
+                    started.wait()
+                    db.insert_to(SampleTable, SampleTable(db.AUTO_INC, f"t{i}"))
+                    db.commit()
+                    for _ in range(20):
+                        counts.append(len(db.query_filters(SampleTable, F("id") <= 100)))
+                    started.wait()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert not errors and {100} == set(counts)
+            assert 104 == len(db.query_all(SampleTable))
+            assert "wal" == db.executor.db.execute("PRAGMA journal_mode;").fetchone()[0]
+            connections = [connection for connection, _ in executor._connections.values()]
+            assert 5 == len(connections)
+        # every thread's connection is closed by stop()
+        assert 0 == executor.connections()
+        self.assertRaises(Exception, connections[0].execute, "SELECT 1")
+
+        # pooled and sharded connections keep the per-thread mode
+        with simpleSQL.connect(serverless=True, database="mydb.db", threadsafe=True, pool_size=1) as db:
+            assert isinstance(db.executor, simpleSQL.executor.ThreadLocalSQLServerLess)
+            pool = db.executor.pool
+        pool.close()
+        executor = simpleSQL.connect(serverless=True, database="sharded.db", threadsafe=True, shards=2,
+                                     shard_key="id")
+        with executor:
+            assert all(isinstance(e, simpleSQL.executor.ThreadLocalSQLServerLess) for e in executor.executors)
+
+    def test_blob_io(self):
+        class Attachment:
+            def __init__(self, id, name, data):
+                self.id = id
+                self.name = name
+                self.data = data
+
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(Attachment, Attachment(db.types.integer(), db.types.varchar(50), db.types.blob()),
+                            primary_key="id")
+            payload = bytes(range(256)) * 400
+            # buffers are bound as they are, without a copy into a str
+            db.insert_to(Attachment, Attachment(1, "a", memoryview(payload)))
+            db.insert_to(Attachment, Attachment(2, "b", None))
+            with db.open_blob(Attachment, "data", 1) as blob:
+                assert len(payload) == len(blob)
+                chunks = iter(lambda: blob.read(4096), b"")
+                assert payload == b"".join(chunks)
+            db.reserve_blob(Attachment, "data", 2, 10000)
+            with db.open_blob(Attachment, "data", 2, "w") as blob:
+                for i in range(0, 10000, 3000):
+                    blob.write(payload[i:min(i + 3000, 10000)])
+                self.assertRaises(ValueError, blob.write, b"x")
+            assert payload[:10000] == db.query_filter_by(Attachment, "id", 2, first=True).data
+            # the chunked fallback used where sqlite3 has no blobopen (Python < 3.11)
+            with simpleSQL.executor.ChunkedBlob(db.executor, "Attachment", "data", "rowid", 2, readonly=False) as blob:
+                blob.seek(-2, os.SEEK_END)
+                blob.write(b"\x00\xff")
+                blob.seek(0)
+                assert payload[:9998] + b"\x00\xff" == blob.read()
+
+    def test_aggregate(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(Sale, Sale(db.types.integer(), db.types.varchar(50), db.types.integer()),
+                            primary_key="id")
+            db.insert_many(Sale, (Sale(i, f"c{i % 3}", i * 2) for i in range(1, 11)))
+            assert 10 == db.count(Sale) and 4 == db.count(Sale, F("price") > 12)
+            assert {"total": 110, "top": 20} == db.aggregate(Sale, {"total": Sum("price"), "top": Max("price")})
+            groups = db.aggregate(Sale, {"n": Count(), "avg": Avg("price")}, group_by="name",
+                                  where=F("id") != 1)
+            assert [("c0", 3, 12.0), ("c1", 3, 14.0), ("c2", 3, 10.0)] == sorted(groups)
+            assert {"c0": 12.0, "c1": 14.0, "c2": 10.0} == {group.name: group.avg for group in groups}
+
+    def test_json_path_filters(self):
+        with simpleSQL.connect(serverless=True, database="mydb.db") as db:
+            db.create_table(TaggedPurchase, TaggedPurchase(db.types.integer(), db.types.varchar(50),
+                                                           db.types.objType(), db.types.objType()), primary_key="id")
+            db.insert_many(TaggedPurchase, (TaggedPurchase(i, f"o{i}", {"price": i * 10, "meta": {"tier": i % 2}},
+                                                           [f"t{i}", i]) for i in range(1, 21)))
+            assert 10 == db.query_filter_by(TaggedPurchase, "details.price", 100, first=True).id
+            assert 4 == len(db.query_filters(TaggedPurchase,
+                                             (F("details.meta.tier") == 1) & (F("details.price") > 120)))
+            assert 7 == db.query_filter_by(TaggedPurchase, "tags.0", "t7", first=True).id
+            assert 5 == db.count(TaggedPurchase, F("tags.1") <= 5)
+            assert [(0, 1100), (1, 1000)] == db.aggregate(TaggedPurchase, {"total": Sum("details.price")},
+                                                          group_by="details.meta.tier")
+            assert 1 == db.aggregate(TaggedPurchase, {"n": Count()}, group_by="details.meta.tier")[1].details_meta_tier
+            self.assertRaises(ValueError, db.query_filter_by, TaggedPurchase, "details.price') OR 1=1 --", 1)
+
+            name = db.create_index(TaggedPurchase, "details.price")
+            assert "idx_TaggedPurchase_details_price" == name
+            plan = db.executor.explain("SELECT * FROM TaggedPurchase WHERE " +
+                                       db.executor.column_sql("TaggedPurchase", "details.price") + " = ?", (100,))
+            assert not db.executor.plan_scans(plan) and name in plan[0][3]
+            # the index is an expression index, rows keep their columns
+            assert {"id", "name", "details", "tags"} == set(db.query_all(TaggedPurchase)[0].__dict__)
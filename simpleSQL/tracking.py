@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import weakref
+from typing import Any, Callable, Iterable
+
+
+class ChangeTracker:
+    def __init__(self, encode: Callable):
+        self._encode = encode
+        self._snapshots = {}
+
+    def track(self, instance: Any, columns: Iterable[str] = None):
+        # snapshots hold encoded values, so in-place changes to list/dict attributes are detected too
+        values = instance.__dict__ if columns is None else {c: instance.__dict__[c] for c in columns}
+        values = {c: self._encode(v) for c, v in values.items()}
+        key = id(instance)
+        entry = self._snapshots.get(key)
+        if entry is not None and entry[0]() is instance:
+            entry[1].update(values)
+            return
+        try:
+            ref = weakref.ref(instance, lambda _, key=key: self._snapshots.pop(key, None))
+        except TypeError:
+            return
+        self._snapshots[key] = (ref, values)
+
+    def snapshot(self, instance: Any) -> [dict, None]:
+        entry = self._snapshots.get(id(instance))
+        if entry is None or entry[0]() is not instance:
+            return None
+        return entry[1]
+
+    def changes(self, instance: Any) -> [list, None]:
+        snapshot = self.snapshot(instance)
+        if snapshot is None:
+            return None
+        return [(c, v) for c, v in instance.__dict__.items() if c in snapshot and self._encode(v) != snapshot[c]]
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import csv
+import itertools
+import json
+import os
+from typing import Callable, Iterable, TextIO
+
+FORMATS = ("jsonl", "csv")
+BUFFER_SIZE = 2 ** 20
+# binary values are written as base64: {"$base64": "..."} in JSONL, a "column:base64" header in CSV
+BASE64_KEY = "$base64"
+BASE64_SUFFIX = ":base64"
+# NULL in CSV, an empty cell is an empty string (a text value of exactly \N reads back as NULL)
+CSV_NULL = "\\N"
+
+
+def file_format(path: str, format: str = None) -> str:
+    format = (format or os.path.splitext(path)[1].lstrip(".")).lower()
+    if format not in FORMATS:
+        raise ValueError(f"unknown format \"{format}\", expected one of {', '.join(FORMATS)}")
+    return format
+
+
+def open_file(path: str, mode: str) -> TextIO:
+    return open(path, mode, buffering=BUFFER_SIZE, encoding="utf-8", newline="")
+
+
+def _b64(val) -> str:
+    return base64.b64encode(val).decode("ascii")
+
+
+def _json_default(val):
+    if isinstance(val, (bytes, bytearray, memoryview)):
+        return {BASE64_KEY: _b64(val)}
+    return str(val)
+
+
+def write_rows(f: TextIO, format: str, names: tuple, rows: Iterable[tuple], encode: Callable,
+               binary: Iterable[str] = ()) -> int:
+    count = 0
+    if format == "csv":
+        # list/dict cells are written in their stored JSON form, NULL as CSV_NULL;
+        # binary columns (by their declared type) as base64
+        binary = set(binary)
+        writer = csv.writer(f)
+        writer.writerow([name + BASE64_SUFFIX if name in binary else name for name in names])
+        is_binary = [name in binary for name in names]
+        for row in rows:
+            cells = []
+            for name, b, v in zip(names, is_binary, row):
+                if v is None:
+                    cells.append(CSV_NULL)
+                elif isinstance(v, (bytes, bytearray, memoryview)):
+                    if not b:
+                        raise ValueError(f"binary value in column \"{name}\" which isn't declared binary, "
+                                         f"export it as jsonl")
+                    cells.append(_b64(v))
+                else:
+                    cells.append(encode(v))
+            writer.writerow(cells)
+            count += 1
+        return count
+    for row in rows:
+        f.write(json.dumps(dict(zip(names, row)), default=_json_default))
+        f.write("\n")
+        count += 1
+    return count
+
+
+def read_rows(f: TextIO, format: str) -> tuple[tuple, Iterable[tuple]]:
+    # -> (column names, lazily parsed rows)
+    if format == "csv":
+        reader = csv.reader(f)
+        header = next(reader, ())
+        binary = [name.endswith(BASE64_SUFFIX) for name in header]
+        names = tuple(name[:-len(BASE64_SUFFIX)] if b else name for name, b in zip(header, binary))
+        return names, (tuple(None if v == CSV_NULL else base64.b64decode(v) if b else v for b, v in zip(binary, row))
+                       for row in reader)
+    records = (json.loads(line) for line in f if line.strip())
+    first = next(records, None)
+    if first is None:
+        return (), iter(())
+    names = tuple(first)
+    return names, (tuple(_json_value(record.get(c)) for c in names)
+                   for record in itertools.chain((first,), records))
+
+
+def _json_value(val):
+    # only top level values carry the marker, a nested dict is part of a JSON column and stays as is
+    if type(val) is dict and len(val) == 1 and BASE64_KEY in val:
+        try:
+            return base64.b64decode(val[BASE64_KEY], validate=True)
+        except (binascii.Error, TypeError):
+            return val
+    return val